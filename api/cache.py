@@ -0,0 +1,382 @@
+"""
+Caches for deterministic backend results.
+
+CompletionCache keeps ChatGPT responses of temperature=0 calls keyed by a hash of (model, temperature, normalized prompt),
+in an in-memory LRU tier backed by an on-disk tier under data/ so that results survive restarts.
+
+ImageCache (optional, IMAGE_CACHE_ENABLED) keeps generated images keyed by (prompt, model, guidance parameters) in a
+content-addressed directory bounded by total size, so repeated text-to-image requests can skip HuggingFace.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from .services import get_config
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_CACHE_ENABLED = (config.get("COMPLETION_CACHE_ENABLED") or "true").lower() == "true"
+COMPLETION_CACHE_DIR = config.get("COMPLETION_CACHE_DIR") or "data/completion_cache"
+COMPLETION_CACHE_TTL = float(config.get("COMPLETION_CACHE_TTL") or 7 * 24 * 3600)
+COMPLETION_CACHE_MAX_MEMORY_ENTRIES = int(config.get("COMPLETION_CACHE_MAX_MEMORY_ENTRIES") or 1024)
+COMPLETION_CACHE_MAX_DISK_ENTRIES = int(config.get("COMPLETION_CACHE_MAX_DISK_ENTRIES") or 20000)
+
+IMAGE_CACHE_ENABLED = (config.get("IMAGE_CACHE_ENABLED") or "false").lower() == "true"
+IMAGE_CACHE_DIR = config.get("IMAGE_CACHE_DIR") or "data/image_cache"
+IMAGE_CACHE_MAX_BYTES = int(config.get("IMAGE_CACHE_MAX_BYTES") or 1024**3)
+# minimum seconds between two eviction scans of the image cache
+IMAGE_CACHE_EVICT_INTERVAL = 5.0
+
+
+# collapse the indentation/newlines of the prompt templates so that formatting changes do not miss the cache
+def normalize_prompt(prompt: str) -> str:
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class CompletionCache:
+    """
+    Two-tier (memory LRU + disk) cache with TTL and hit/miss counters.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = COMPLETION_CACHE_DIR,
+        ttl: float = COMPLETION_CACHE_TTL,
+        max_memory_entries: int = COMPLETION_CACHE_MAX_MEMORY_ENTRIES,
+        max_disk_entries: int = COMPLETION_CACHE_MAX_DISK_ENTRIES,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()  # key -> (created timestamp, value)
+        self._lock = threading.Lock()
+        self._writes_since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expired = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model: str, temperature: float, prompt: str) -> str:
+        raw = json.dumps([model, temperature, normalize_prompt(prompt)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str):
+        """
+        Returns the cached value for key or None, checking memory before disk.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return value
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if now - record["created"] > self.ttl:
+            with self._lock:
+                self.expired += 1
+                self.misses += 1
+            _remove_file(path)
+            return None
+
+        # touch the file so that disk eviction is least-recently-used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self._remember(key, record["created"], record["value"])
+        with self._lock:
+            self.disk_hits += 1
+        return record["value"]
+
+    def set(self, key: str, value: str) -> None:
+        created = time.time()
+        self._remember(key, created, value)
+
+        # write to a temporary file first so that readers never see a partial entry
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created": created, "value": value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write completion cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            self._writes_since_prune += 1
+            should_prune = self._writes_since_prune >= 100
+            if should_prune:
+                self._writes_since_prune = 0
+        if should_prune:
+            self.prune_disk()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._memory.pop(key, None)
+        _remove_file(self._path(key))
+
+    def prune_disk(self) -> None:
+        """
+        Removes expired entries and the least recently used ones beyond max_disk_entries.
+        """
+        now = time.time()
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(".json"):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            if now - mtime > self.ttl:
+                _remove_file(path)
+            else:
+                entries.append((mtime, path))
+
+        excess = len(entries) - self.max_disk_entries
+        if excess > 0:
+            for _, path in sorted(entries)[:excess]:
+                _remove_file(path)
+
+    @run_in_threadpool_decorator("disk_io")
+    def aget(self, key: str):
+        return self.get(key)
+
+    @run_in_threadpool_decorator("disk_io")
+    def aset(self, key: str, value: str) -> None:
+        return self.set(key, value)
+
+    @run_in_threadpool_decorator("disk_io")
+    def adelete(self, key: str) -> None:
+        return self.delete(key)
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+            }
+
+
+# process-wide completion cache, created on first use
+_completion_cache = None
+
+
+def get_completion_cache() -> CompletionCache:
+    global _completion_cache
+    if _completion_cache is None:
+        _completion_cache = CompletionCache()
+    return _completion_cache
+
+
+def completion_cache_stats() -> dict:
+    if _completion_cache is None:
+        return {}
+    return _completion_cache.stats()
+
+
+class ImageCache:
+    """
+    Content-addressed store of generated images with size-bounded LRU eviction.
+
+    Layout under cache_dir:
+        objects/<sha256 of image bytes>.<ext>  - image files, shared by identical images
+        index/<request key>.json               - maps a request key to the object holding its image
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = IMAGE_CACHE_DIR,
+        max_bytes: int = IMAGE_CACHE_MAX_BYTES,
+        evict_interval: float = IMAGE_CACHE_EVICT_INTERVAL,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        # size of the stored objects, counted by the first eviction scan and kept up to date by set()
+        self._total_bytes = None
+        self._last_evict = 0.0
+        self.objects_dir = os.path.join(cache_dir, "objects")
+        self.index_dir = os.path.join(cache_dir, "index")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(prompt: str, model: str, params: dict) -> str:
+        raw = json.dumps([normalize_prompt(prompt), model, params], sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _index_path(self, key: str) -> str:
+        return os.path.join(self.index_dir, f"{key}.json")
+
+    def get(self, key: str):
+        """
+        Returns the cached image bytes for key or None.
+        """
+        index_path = self._index_path(key)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            with open(os.path.join(self.objects_dir, record["object"]), "rb") as f:
+                data = f.read()
+            os.utime(index_path)  # mark as recently used for eviction
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def set(self, key: str, data: bytes, ext: str = "png") -> None:
+        object_name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+        object_path = os.path.join(self.objects_dir, object_name)
+        index_path = self._index_path(key)
+        tmp_suffix = f".{threading.get_ident()}.tmp"
+        # the object and its index entry are written under the lock, so eviction never sees an unreferenced new object
+        with self._lock:
+            try:
+                # identical images are stored once
+                if not os.path.exists(object_path):
+                    with open(object_path + tmp_suffix, "wb") as f:
+                        f.write(data)
+                    os.replace(object_path + tmp_suffix, object_path)
+                    if self._total_bytes is not None:
+                        self._total_bytes += len(data)
+                with open(index_path + tmp_suffix, "w", encoding="utf-8") as f:
+                    json.dump({"object": object_name, "created": time.time()}, f)
+                os.replace(index_path + tmp_suffix, index_path)
+            except OSError as e:
+                logger.warning(f"Failed to write image cache entry {key}: {e}")
+                return
+            # scan the store only when it may be over budget, and at most every evict_interval seconds
+            over_budget = self._total_bytes is None or self._total_bytes > self.max_bytes
+            if not over_budget or time.monotonic() - self._last_evict < self.evict_interval:
+                return
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Drops the least recently used index entries (and unreferenced objects) until the store fits max_bytes.
+        """
+        with self._lock:
+            self._last_evict = time.monotonic()
+            entries = []
+            references = {}
+            for file_name in os.listdir(self.index_dir):
+                if not file_name.endswith(".json"):
+                    continue
+                path = os.path.join(self.index_dir, file_name)
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        object_name = json.load(f)["object"]
+                    entries.append((os.path.getmtime(path), path, object_name))
+                except (OSError, ValueError, KeyError):
+                    continue
+                references[object_name] = references.get(object_name, 0) + 1
+
+            sizes = {}
+            for object_name in os.listdir(self.objects_dir):
+                path = os.path.join(self.objects_dir, object_name)
+                if object_name.endswith(".tmp"):
+                    continue
+                if object_name not in references:
+                    # orphaned object left behind by an earlier eviction or failed write
+                    _remove_file(path)
+                    continue
+                try:
+                    sizes[object_name] = os.path.getsize(path)
+                except OSError:
+                    continue
+
+            total_bytes = sum(sizes.values())
+            for _, path, object_name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                _remove_file(path)
+                self.evictions += 1
+                references[object_name] -= 1
+                if references[object_name] == 0:
+                    _remove_file(os.path.join(self.objects_dir, object_name))
+                    total_bytes -= sizes.get(object_name, 0)
+            self._total_bytes = total_bytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+# process-wide image cache, created on first use
+_image_cache = None
+
+
+def get_image_cache() -> ImageCache:
+    global _image_cache
+    if _image_cache is None:
+        _image_cache = ImageCache()
+    return _image_cache
+
+
+def image_cache_stats() -> dict:
+    if _image_cache is None:
+        return {}
+    return _image_cache.stats()
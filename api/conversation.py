@@ -11,15 +11,38 @@ def function_that_blocks(some_input) -> None:
 async nonblocking_func() -> None:
     await function_that_blocks(some_input) # Spins up the function in a separate thread.
 """
-import openai
+import asyncio
 import logging
-from dotenv import dotenv_values
-import json
+from .services import get_config, services
+import hashlib
+import html
 import random
-from huggingface_hub import InferenceClient
+import io
 from .utils import run_in_threadpool_decorator
+from .scheduler import get_scheduler
+from .streaming import COMPLETION_STREAMING, ProgressiveMessage
+from .speculation import SPECULATIVE_DESIGN_THEMES, SPECULATIVE_DESIGNS_ENABLED, get_speculative_tasks
+from .log_setup import log_update, timed
+from .prompts import DESIGN_PROMPTS_ENABLED, build_image_prompt, design_prompt_instructions, estimate_tokens, record_token_usage
+from .imaging import (
+    IMAGE_ARCHIVE_ENABLED,
+    IMAGE_OUTPUT_FORMAT,
+    archive_image,
+    buffer_from_bytes,
+    encode_image,
+    image_extension,
+)
+from .parsing import ResponseParseError, build_repair_messages, parse_partial, parse_response, record_parse_event
+from .cache import (
+    COMPLETION_CACHE_ENABLED,
+    IMAGE_CACHE_ENABLED,
+    CompletionCache,
+    ImageCache,
+    get_completion_cache,
+    get_image_cache,
+)
 
-from telegram import ForceReply, Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from telegram import ForceReply, Update, ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, InputMediaPhoto
 from telegram import __version__ as TG_VER
 from telegram import (
     Update,
@@ -44,11 +67,8 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
     )
 
 # get config 
-config = dotenv_values(".env")
+config = get_config()
 
-# get API tokens
-HF_TOKEN = config['HF_API_KEY']
-openai.api_key = config['OPENAI_API_KEY']
 
 # assign variable name for each integer in sequence for easy tracking of conversation
 (RESET_CHAT, 
@@ -69,35 +89,274 @@ lst_govt_agencies = ['Housing Development Board (HDB)',
                      'Others']
 
 
-# Enable logging
-logging.basicConfig(
-                    format="%(asctime)s - %(processName)s - %(threadName)s - [%(thread)d] - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
-                    )
+# get logger (handlers and levels are set up by the bot with configure_logging)
 logger = logging.getLogger(__name__)
-huggingFaceLogger = logging.getLogger("huggingface_hub").setLevel(logging.DEBUG)
-messageHandlerLogger = logging.getLogger("telegram.bot").setLevel(logging.DEBUG)
-applicationLogger = logging.getLogger("telegram.ext").setLevel(logging.DEBUG)
 
 
 
 # define helper function to get model's response (using "gpt-3.5-turbo")
-@run_in_threadpool_decorator("gpt_threads")
-def get_completion(prompt:str, model: str, temperature: float) -> str:
+# uses the shared asyncio connection pool instead of a thread per call
+# deterministic calls (temperature=0) are served from the completion cache when possible,
+# randomized calls (e.g. "Propose other themes") always reach the model
+# calls to the model wait for a slot of the completion scheduler (fair across users, see api/scheduler.py)
+# with on_text the response is streamed and on_text(text so far, new text) is called as tokens arrive
+# input/output tokens of calls reaching the model are recorded under step (see api/prompts.py)
+async def get_completion(prompt:str, model: str, temperature: float, user_id: int = None, on_queued = None, low_priority: bool = False,
+                         on_text = None, step: str = 'other') -> str:
+    use_cache = COMPLETION_CACHE_ENABLED and temperature == 0
+    if use_cache:
+        cache = get_completion_cache()
+        cache_key = CompletionCache.make_key(model, temperature, prompt)
+        cached_response = await cache.aget(cache_key)
+        if cached_response is not None:
+            return cached_response
+
     messages = [{"role": "user", "content": prompt}]
-    response = openai.ChatCompletion.create(
-        model=model,
-        messages=messages,
-        temperature=temperature, # this is the degree of randomness of the model's output
-    )
-    return response.choices[0].message["content"]
+    async with get_scheduler('completion').acquire(user_id, on_queued = on_queued, low_priority = low_priority):
+        if on_text is not None:
+            content = ''
+            async for delta in services.openai.stream(messages=messages, model=model, temperature=temperature):
+                content += delta
+                on_text(content, delta)
+            usage = {}
+        else:
+            response = await services.openai.create(
+                messages=messages,
+                model=model,
+                temperature=temperature, # this is the degree of randomness of the model's output
+            )
+            content = response['choices'][0]['message']['content']
+            usage = response.get('usage') or {}
+    # streamed responses carry no usage, estimate it locally
+    record_token_usage(step,
+                       usage.get('prompt_tokens') or estimate_tokens(prompt),
+                       usage.get('completion_tokens') or estimate_tokens(content))
+
+    if use_cache:
+        await cache.aset(cache_key, content)
+    return content
+
+# number of times the model is asked to fix a response that cannot be parsed
+MAX_REPAIR_RETRIES = int(config.get('MAX_REPAIR_RETRIES') or 1)
+
+# define helper function to get model's response parsed and validated for the given step ('themes', 'designs', 'prompt')
+# the model is only asked again (with its previous reply) when the response truly cannot be parsed
+# with on_partial the response is streamed and on_partial(items) is called whenever another complete item arrived
+async def get_structured_completion(prompt: str, model: str, temperature: float, step: str, user_id: int = None, on_queued = None,
+                                    low_priority: bool = False, on_partial = None):
+    on_text = None
+    if on_partial is not None:
+        items_shown = 0
+        def on_text(text: str, delta: str) -> None:
+            nonlocal items_shown
+            # an item can only be complete once its closing delimiter arrived
+            if ',' not in delta and '}' not in delta:
+                return
+            items = parse_partial(text, step)
+            if len(items) > items_shown:
+                items_shown = len(items)
+                on_partial(items)
+    response = await get_completion(prompt, model, temperature, user_id = user_id, on_queued = on_queued, low_priority = low_priority,
+                                    on_text = on_text, step = step)
+    try:
+        return parse_response(response, step)
+    except ResponseParseError as e:
+        error = e
+    
+    # do not keep serving the unusable response from the completion cache
+    if COMPLETION_CACHE_ENABLED and temperature == 0:
+        await get_completion_cache().adelete(CompletionCache.make_key(model, temperature, prompt))
+    
+    for _ in range(MAX_REPAIR_RETRIES):
+        record_parse_event(step, 'retries')
+        async with get_scheduler('completion').acquire(user_id):
+            completion = await services.openai.create(
+                messages=build_repair_messages(prompt, response, error),
+                model=model,
+                temperature=0,
+            )
+        response = completion['choices'][0]['message']['content']
+        usage = completion.get('usage') or {}
+        record_token_usage(step, usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0))
+        try:
+            return parse_response(response, step)
+        except ResponseParseError as e:
+            error = e
+    raise error
+
+# define helper function that tells the user their place in line while the backends are busy
+# the returned callback is passed as on_queued to the scheduled calls of one request and only sends one message
+def queue_position_notifier(update: Update):
+    notified = False
+    async def notify(position: int) -> None:
+        nonlocal notified
+        if notified:
+            return
+        notified = True
+        await update.effective_message.reply_text(f'Lots of requests right now, you are #{position} in line \U0001F557')
+    return notify
+
+# define helper functions to show the themes/image designs received so far while the response is streamed
+# (COMPLETION_STREAMING) in a separate message, edited in place and removed once the full list is sent
+def render_partial_themes(progress: ProgressiveMessage):
+    if not COMPLETION_STREAMING:
+        return None
+    def render(themes: dict) -> None:
+        output_text = '\U0001F538 <strong>Loading proposed themes based on purpose</strong> \U0001F538\n\n'
+        for theme_index, theme in themes.items():
+            output_text += f'<strong>Theme {theme_index}</strong>\n{html.escape(theme)}\n\n'
+        progress.update(output_text)
+    return render
+
+def render_partial_designs(progress: ProgressiveMessage):
+    if not COMPLETION_STREAMING:
+        return None
+    def render(image_designs_dict: dict) -> None:
+        output_text = '\U0001F538 <strong>Loading proposed image designs</strong> \U0001F538\n\n'
+        for output_id, output in image_designs_dict.items():
+            output_text += f'<strong>Image Design {output_id[-1]}</strong>\n'
+            output_text += f'\u25AA Image description: <i>{html.escape(str(output["image description"]))}</i>\n\n'
+        progress.update(output_text)
+    return render
 
-# define helper function to generate image
+# define helper function to inform user that the model's response could not be used
+async def reply_parse_failure(update: Update, retry_hint: str) -> None:
+    await update.message.reply_text(
+                                    f'Sorry, I could not understand the response of the AI model \U0001F615\n\n{retry_hint}',
+                                    )
+
+# range of guidance scale sampled for each generated image
+GUIDANCE_SCALE_RANGE = (6, 9)
+# number of candidate images generated concurrently per request (varying guidance scale and seed)
+IMAGE_CANDIDATES = min(max(int(config.get('IMAGE_CANDIDATES') or 1), 1), 10)
+# send the first finished candidate right away instead of waiting for all of them
+IMAGE_SEND_FIRST = (config.get('IMAGE_SEND_FIRST') or 'true').lower() == 'true'
+
+# define helper function to generate image (reuses the long-lived inference client of the default model)
+# returns the encoded image in memory, identical requests are served from the image cache unless force_fresh is set
+# candidates of the same prompt are cached separately
 @run_in_threadpool_decorator("hugging_face_threads")
-def txt2img(txt: str, image_path: str) -> None:
-    client = InferenceClient(token=HF_TOKEN)
-    image = client.text_to_image(prompt = txt, guidance_scale = random.uniform(6,9))
-    image.save(image_path)
-    return 0
+def txt2img(txt: str, force_fresh: bool = False, candidate: int = 0, guidance_scale: float = None, seed: int = None) -> io.BytesIO:
+    backend = services.image_backend()
+    use_cache = IMAGE_CACHE_ENABLED
+    if use_cache:
+        cache = get_image_cache()
+        cache_params = {'guidance_scale_range': GUIDANCE_SCALE_RANGE, 'format': IMAGE_OUTPUT_FORMAT}
+        if candidate:
+            cache_params['candidate'] = candidate
+        cache_key = ImageCache.make_key(txt, backend.model, cache_params)
+        if not force_fresh:
+            image_bytes = cache.get(cache_key)
+            if image_bytes is not None:
+                return buffer_from_bytes(image_bytes)
+
+    if guidance_scale is None:
+        guidance_scale = random.uniform(*GUIDANCE_SCALE_RANGE)
+    params = {'guidance_scale': guidance_scale}
+    if seed is not None:
+        params['seed'] = seed
+    image = backend.text_to_image(txt, **params)
+    image_buffer = encode_image(image)
+
+    if use_cache:
+        cache.set(cache_key, image_buffer.getvalue(), ext = image_extension())
+    return image_buffer
+
+# define helper function to send a generated image, returns the Telegram file_id of the sent photo
+# re-sending with file_id skips the upload as Telegram already stores the image
+async def send_generated_image(context: ContextTypes.DEFAULT_TYPE, image_buffer: io.BytesIO = None, file_id: str = None) -> str:
+    if file_id is not None:
+        message = await context.bot.send_photo(
+            chat_id = context.user_data['chat_id'],
+            photo = file_id,
+        )
+    else:
+        image_buffer.seek(0)
+        message = await context.bot.send_photo(
+            chat_id = context.user_data['chat_id'],
+            photo = image_buffer,
+            write_timeout = 150
+        )
+    return message.photo[-1].file_id
+
+# define helper function to send several images as one album, returns the Telegram file_ids of the sent photos
+async def send_generated_media_group(context: ContextTypes.DEFAULT_TYPE, photos: list) -> list:
+    for photo in photos:
+        if isinstance(photo, io.BytesIO):
+            photo.seek(0)
+    messages = await context.bot.send_media_group(
+        chat_id = context.user_data['chat_id'],
+        media = [InputMediaPhoto(photo) for photo in photos],
+        write_timeout = 150
+    )
+    return [message.photo[-1].file_id for message in messages]
+
+# define helper function to send already delivered images again by their file_ids
+async def resend_generated_images(context: ContextTypes.DEFAULT_TYPE, file_ids: list) -> list:
+    if len(file_ids) == 1:
+        return [await send_generated_image(context, file_id = file_ids[0])]
+    return await send_generated_media_group(context, file_ids)
+
+# define helper function to generate an image and optionally keep a copy on disk (IMAGE_ARCHIVE_ENABLED)
+# each generation waits for a slot of the image scheduler (fair across users, see api/scheduler.py)
+async def generate_image_buffer(image_prompt: str, username: str, force_fresh: bool = False, user_id: int = None,
+                                candidate: int = 0, guidance_scale: float = None, seed: int = None,
+                                on_queued = None) -> io.BytesIO:
+    async with get_scheduler('image').acquire(user_id or username, on_queued = on_queued):
+        image_buffer = await txt2img(image_prompt, force_fresh = force_fresh, candidate = candidate,
+                                     guidance_scale = guidance_scale, seed = seed)
+    if IMAGE_ARCHIVE_ENABLED:
+        await archive_image(image_buffer.getvalue(), username)
+    return image_buffer
+
+# define helper function to generate IMAGE_CANDIDATES images concurrently and send them to the user
+# guidance scales are spread over GUIDANCE_SCALE_RANGE and each candidate gets its own seed
+# with IMAGE_SEND_FIRST the first finished image is sent right away and the rest follow as an album
+# the candidates share the user's and the global budget of the image scheduler: at most IMAGE_MAX_CONCURRENT_PER_USER
+# run at once, and the fan-out is capped so it never exceeds what the user may have running and waiting
+# returns the Telegram file_ids of the sent photos, fails only if no candidate could be generated
+async def generate_and_send_images(context: ContextTypes.DEFAULT_TYPE, image_prompt: str, username: str,
+                                   user_id: int, force_fresh: bool = False, candidates: int = IMAGE_CANDIDATES,
+                                   on_queued = None) -> list:
+    scheduler = get_scheduler('image')
+    candidates = min(candidates, scheduler.per_user_limit + scheduler.max_user_backlog)
+    if candidates <= 1:
+        image_buffer = await generate_image_buffer(image_prompt, username, force_fresh = force_fresh, user_id = user_id,
+                                                   on_queued = on_queued)
+        return [await send_generated_image(context, image_buffer = image_buffer)]
+
+    low, high = GUIDANCE_SCALE_RANGE
+    tasks = [
+        asyncio.create_task(generate_image_buffer(image_prompt, username, force_fresh = force_fresh, user_id = user_id,
+                                                  candidate = candidate,
+                                                  guidance_scale = low + (high - low) * (candidate + 0.5) / candidates,
+                                                  seed = random.randrange(2 ** 32), on_queued = on_queued))
+        for candidate in range(candidates)
+    ]
+    file_ids, pending_buffers, errors = [], [], []
+    try:
+        for next_finished in asyncio.as_completed(tasks):
+            try:
+                image_buffer = await next_finished
+            except Exception as e:
+                logger.warning(f'Image candidate for {username} failed: {e}')
+                errors.append(e)
+                continue
+            if IMAGE_SEND_FIRST and not file_ids:
+                file_ids.append(await send_generated_image(context, image_buffer = image_buffer))
+            else:
+                pending_buffers.append(image_buffer)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    if len(pending_buffers) == 1:
+        file_ids.append(await send_generated_image(context, image_buffer = pending_buffers[0]))
+    elif pending_buffers:
+        file_ids.extend(await send_generated_media_group(context, pending_buffers))
+    if not file_ids:
+        raise errors[0]
+    return file_ids
 
 
 # function for /start command (CommandHandler type)
@@ -132,6 +391,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         # store username
         context.user_data['username'] = username
         
+    # stop any background work left from a previous conversation
+    get_speculative_tasks().cancel(user.id)
+    
     # remove 'assistance_type' and 'state_for_assistance_type' keys for returning users
     if 'assistance_type' in context.user_data.keys():
         del context.user_data['assistance_type']
@@ -372,11 +634,12 @@ async def get_theme(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         
         return prompt
 
-    # inform user to wait
+    # inform user to wait (the themes received so far are shown in a separate message when streaming)
     await update.message.reply_html(
                                     f'''\U0001F538 <strong>Loading proposed themes based on purpose</strong> \U0001F538''',
                                     reply_markup = ReplyKeyboardRemove(),
                                     ) 
+    progress = ProgressiveMessage(update.message)
     
     # get user's company
     company = context.user_data['company']
@@ -394,8 +657,14 @@ async def get_theme(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         prompt = get_prompt(company, image_type, user_input)
         
         # get chatgpt's response (random temperature value between 0.1 to 0.6)
-        response = await get_completion(prompt,"gpt-3.5-turbo" , random.uniform(0.1, 0.6))
-        themes = eval(response)
+        try:
+            themes = await get_structured_completion(prompt, "gpt-3.5-turbo", random.uniform(0.1, 0.6), 'themes', user_id = update.effective_user.id, on_queued = queue_position_notifier(update),
+                                                     on_partial = render_partial_themes(progress))
+        except ResponseParseError:
+            await reply_parse_failure(update, 'Send /choosetheme to select any of the previously proposed themes.')
+            return SELECT_IMAGE_DESIGN
+        finally:
+            await progress.close()
         
     else:
         # get user input (purpose of image)
@@ -408,8 +677,14 @@ async def get_theme(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         prompt = get_prompt(company, image_type, user_input)
         
         # get chatgpt's response
-        response = await get_completion(prompt, "gpt-3.5-turbo", 0)
-        themes = eval(response)
+        try:
+            themes = await get_structured_completion(prompt, "gpt-3.5-turbo", 0, 'themes', user_id = update.effective_user.id, on_queued = queue_position_notifier(update),
+                                                     on_partial = render_partial_themes(progress))
+        except ResponseParseError:
+            await reply_parse_failure(update, 'Please type out the purpose of the image again.')
+            return SELECT_THEME
+        finally:
+            await progress.close()
 
     # store results
     context.user_data['theme_output_json'] = themes
@@ -440,6 +715,9 @@ async def get_theme(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
                                     f'{output_text}',
                                     reply_markup = ReplyKeyboardMarkup(buttons_lst, resize_keyboard = True),
                                     )      
+    
+    # compute the image designs of the first themes while the user is choosing
+    start_speculative_designs(context, update.effective_user.id, company, image_type, lst_themes)
 
     return SELECT_IMAGE_DESIGN
 
@@ -512,54 +790,103 @@ async def get_previous_themes(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     return SELECT_IMAGE_DESIGN
     
+# define helper function to get image design prompt with template
+def get_image_design_prompt(company, selected_theme, image_type):
+    # specify design attributes format for chatgpt
+    design_attributes = {
+        'image description': 'none',
+        'style of visual image': 'none',
+        'object in foreground description': 'none'
+    }
+
+    # write the prompt to chatgpt
+    prompt = r'''
+    You are a digital marketing AI assistant for '''+ company + r''' in Singapore. 
+    Given the theme of a '''+ image_type + r''' delimited by ```, suggest 5 different outputs to replace "none" 
+    for the specified design attributes provided in a JSON format delimited by ```.
+    Keep in mind that the outputs must either be modern, futuristic, minimalistic, or stylish.
+    Use '\'s' for any word that requires ```'s```, example: the house\'s window.
+
+    Return the output in a JSON format, example:
+    {'output_1': {
+        'image description': "none",
+        'style of visual image': "none",
+        'object in foreground description': "none",
+        },
+    'output_2': {'image description': "none",
+        'style of visual image': "none",
+        'object in foreground description': "none",
+        },
+    'output_3': {'image description': "none",
+        'style of visual image': "none",
+        'object in foreground description': "none",
+        }
+    }''' + f'''
+    theme: {selected_theme}
+    design attributes: {design_attributes}'''
+
+    # ask for each design's finished text-to-image prompt in the same response
+    if DESIGN_PROMPTS_ENABLED:
+        prompt += design_prompt_instructions(prompt, image_type, selected_theme)
+
+    return prompt
+
+# define helper function to get the key of an image design prompt in the speculative designs cache
+def get_design_key(prompt: str) -> str:
+    return hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+
+# define helper function to compute the image designs of a proposed theme in the background (low priority)
+# the result is cached in user_data so that selecting the theme returns the designs immediately
+async def precompute_image_designs(context: ContextTypes.DEFAULT_TYPE, user_id: int, prompt: str) -> dict:
+    image_designs_dict = await get_structured_completion(prompt, "gpt-3.5-turbo", 0, 'designs', user_id = user_id, low_priority = True)
+    if 'image_info' in context.user_data:
+        context.user_data['image_info'].setdefault('speculative_designs', {})[get_design_key(prompt)] = image_designs_dict
+    return image_designs_dict
+
+# define helper function to start precomputing the image designs of the first proposed themes (SPECULATIVE_DESIGNS_ENABLED)
+def start_speculative_designs(context: ContextTypes.DEFAULT_TYPE, user_id: int, company: str, image_type: str, themes: list) -> None:
+    speculative_tasks = get_speculative_tasks()
+    speculative_tasks.cancel(user_id)
+    context.user_data['image_info']['speculative_designs'] = {}
+    if not SPECULATIVE_DESIGNS_ENABLED:
+        return
+    for theme in themes[:SPECULATIVE_DESIGN_THEMES]:
+        prompt = get_image_design_prompt(company, theme, image_type)
+        # prompt plus a reply of about the same size
+        estimated_tokens = 2 * estimate_tokens(prompt)
+        speculative_tasks.start(user_id, get_design_key(prompt), precompute_image_designs(context, user_id, prompt), estimated_tokens)
+
+# define helper function to get the speculatively computed image designs of a prompt, waits for them if still running
+# a task still waiting for a slot is promoted to regular priority, as the user now waits for it
+async def get_speculative_designs(context: ContextTypes.DEFAULT_TYPE, user_id: int, prompt: str):
+    design_key = get_design_key(prompt)
+    task = get_speculative_tasks().take(user_id, design_key)
+    # the user moved on, drop the designs computed for the other themes
+    get_speculative_tasks().cancel(user_id)
+    image_designs_dict = context.user_data['image_info'].get('speculative_designs', {}).get(design_key)
+    if image_designs_dict is None and task is not None:
+        if not task.done():
+            get_scheduler('completion').promote(task)
+        try:
+            image_designs_dict = await task
+        except Exception:
+            # rejected by the scheduler or failed, fall back to a regular request
+            return None
+    return image_designs_dict
+
 # function to select image design based on selected theme
 async def select_image_design(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     '''
     Prompts ChatGPT to generate image designs and sends a message to ask user 
     to select one of the generated image designs.
     '''
-    # helper function to get image design prompt with template
-    def get_prompt(company, selected_theme, image_type):
-        # specify design attributes format for chatgpt
-        design_attributes = {
-            'image description': 'none',
-            'style of visual image': 'none',
-            'object in foreground description': 'none'
-        }
-        
-        # write the prompt to chatgpt
-        prompt = r'''
-        You are a digital marketing AI assistant for '''+ company + r''' in Singapore. 
-        Given the theme of a '''+ image_type + r''' delimited by ```, suggest 5 different outputs to replace "none" 
-        for the specified design attributes provided in a JSON format delimited by ```.
-        Keep in mind that the outputs must either be modern, futuristic, minimalistic, or stylish.
-        Use '\'s' for any word that requires ```'s```, example: the house\'s window.
-
-        Return the output in a JSON format, example:
-        {'output_1': {
-            'image description': "none",
-            'style of visual image': "none",
-            'object in foreground description': "none",
-            },
-        'output_2': {'image description': "none",
-            'style of visual image': "none",
-            'object in foreground description': "none",
-            },
-        'output_3': {'image description': "none",
-            'style of visual image': "none",
-            'object in foreground description': "none",
-            }
-        }''' + f'''
-        theme: {selected_theme}
-        design attributes: {design_attributes}'''
-        
-        return prompt
     
-    # inform user to wait
+    # inform user to wait (the image designs received so far are shown in a separate message when streaming)
     await update.message.reply_html(
                                     f'''\U0001F538 <strong>Loading proposed image designs</strong> \U0001F538''',
                                     reply_markup = ReplyKeyboardRemove(),
                                     ) 
+    progress = ProgressiveMessage(update.message)
     
     # get user's company
     company = context.user_data['company']
@@ -573,11 +900,17 @@ async def select_image_design(update: Update, context: ContextTypes.DEFAULT_TYPE
         image_type = context.user_data['image_info']['image_type']
         
         # get prompt for chatgpt
-        prompt = get_prompt(company, selected_theme, image_type)
+        prompt = get_image_design_prompt(company, selected_theme, image_type)
         
         # get chatgpt's response (increased temperature from 0.1 to 0.6)
-        response = await get_completion(prompt, "gpt-3.5-turbo", random.uniform(0.1, 0.6))
-        image_designs_dict = eval(response)
+        try:
+            image_designs_dict = await get_structured_completion(prompt, "gpt-3.5-turbo", random.uniform(0.1, 0.6), 'designs', user_id = update.effective_user.id, on_queued = queue_position_notifier(update),
+                                                                 on_partial = render_partial_designs(progress))
+        except ResponseParseError:
+            await reply_parse_failure(update, 'Send /choosedesign to select any of the previously proposed image designs.')
+            return GENERATE_PROMPT_AND_IMAGE
+        finally:
+            await progress.close()
     
     # new user's image designs generation
     else: 
@@ -602,11 +935,19 @@ async def select_image_design(update: Update, context: ContextTypes.DEFAULT_TYPE
         image_type = context.user_data['image_info']['image_type']
         
         # get prompt for chatgpt
-        prompt = get_prompt(company, selected_theme, image_type)
+        prompt = get_image_design_prompt(company, selected_theme, image_type)
         
-        # get chatgpt's response
-        response = await get_completion(prompt, "gpt-3.5-turbo", 0)
-        image_designs_dict = eval(response)
+        # get chatgpt's response (precomputed in the background when the themes were proposed, if enabled)
+        try:
+            image_designs_dict = await get_speculative_designs(context, update.effective_user.id, prompt)
+            if image_designs_dict is None:
+                image_designs_dict = await get_structured_completion(prompt, "gpt-3.5-turbo", 0, 'designs', user_id = update.effective_user.id, on_queued = queue_position_notifier(update),
+                                                                     on_partial = render_partial_designs(progress))
+        except ResponseParseError:
+            await reply_parse_failure(update, 'Send /choosetheme to select a theme again.')
+            return SELECT_IMAGE_DESIGN
+        finally:
+            await progress.close()
         
     # store image designs output
     context.user_data['image_info']['image_design_output_json'] = image_designs_dict
@@ -815,56 +1156,23 @@ async def generate_prompt_and_image(update: Update, context: ContextTypes.DEFAUL
             'resolution': '8k'
         }
 
-    sample_prompts = ['A still life of flowers, in the style of Jan van Huysum’s paintings, with a lush arrangement of blooms in a vase, surrounded by delicate butterflies, bees, and other insects.',
-                    'A digital collage of iconic tech gadgets, such as the iPhone, MacBook, and Amazon Echo, in the style of David Hockney.',
-                    'A surreal underwater world in the style of Salvador Dali, where all the sea creatures are actually different tech gadgets like iPhones, laptops, and smartwatches, floating amongst the seaweed and coral.',
-                    'A space station in the style of Stanley Kubrick’s 2001: A Space Odyssey, where all the spaceships and equipment are made of different popular candy bars like Snickers, Milky Way, and Three Musketeers, and all the astronauts are dressed as characters from Star Trek.',
-                    'A retro pop art-style illustration of the famous Hollywood sign, surrounded by colorful and iconic classic cars like the Corvette and the Mustang.',
-                    'A surreal, abstract landscape, inspired by Joan Miró’s paintings, with strange shapes, lines, and colors arranged in an imaginary world, with floating objects like planets and stars.',
-                    'main model shoot style, 8k 3d render sharp focus photography low angle shot high detail, beautiful Chinese fantasy woman portrait, teenage 23 years old, Looking at camera, fierce gaze, black lace textures, Michael parkes art, fantasy concept, 1379 Chiba imperial dynasty concubine. mythology, sleeveless gothic black gown, holding a dragon, red lips stained dripping honey, floral flower organic textures. realistic object octane Renders, outdoor lowlight moonlight dark dirty forest, dynamic lighting full length portrait, octane volumetric lighting, edge lighting, octane render, 8k, perfect shading, trending on artstation, ultra-realistic, concept art, Dark Mode, Tones of Black in Background, Spotlight, Beautiful cinematic shot + photos taken by ARRI, photos taken by sony, photos taken by canon, photos taken by nikon, photos taken by sony, photos taken by hasselblad + incredibly detailed, sharpen, details + professional lighting, photography lighting + 50mm, 80mm, 100m + lightroom gallery + behance photographys + unsplash –ar 2:3'
-                    'The Battle of Agincourt, 1415 - A bird’s eye view of the Battle of Agincourt, with English and French soldiers clashing on the battlefield and arrows raining down from the sky. In the style of Peter Paul Rubens’ Baroque battle scenes.',
-                    'A steampunk-inspired train station, where all the trains are made of different popular soda brands like Coca-Cola, Pepsi, and Dr. Pepper, and the passengers are robots and cyborgs.',
-                    'A spooky graveyard in the style of Edward Gorey, where all the tombstones and monuments are made of different popular cookies like Oreos, Chips Ahoy, and Nutter Butters, and all the ghosts are dressed as characters from The Addams Family.',
-                    'Create a photojournalistic-style image of Winston Smith as he starts to rebel against the oppressive government in George Orwell’s “1984.” Show him standing in front of a “Big Brother” poster, with a determined look on his face and the cityscape of Airstrip One in the background.',
-                    'Using a minimalist, sketch-like style, create an image of Holden Caulfield sitting on a bench in Central Park, New York, deep in thought as he contemplates the world around him. Show his melancholic expression and the cityscape behind him, with a backdrop of the wintry New York sky.',
-                    'Using a whimsical, fantasy-style illustration, create an image of Alice in Wonderland falling down the rabbit hole. Show her surrounded by fantastical creatures, with the White Rabbit peeking out from behind a tree and a sense of wonder and adventure in the air.'
-                    ]
-
-    prompt = r'''
-    You are a digital marketing AI assistant for '''+ company + r''' in Singapore. 
-    Your task is to describe the image based on specified design attributes such as type, description 
-    and styling of image which will be given in a JSON format.
-    Follow the description structure of the list of sample image descriptions provided which are delimited by ```.
-    Then, given the design attributes delimited by ``` , 
-    describe the image as a prompt in a JSON format: {'prompt': generated_output}
-    where the generated output will replace the space of 'generated_output'.
-    Use '\'s' for any word that requires ```'s```, example: the house\'s window.
-    
-    To describe the image, do the following:
-    - first, describe the image given the design attributes
-    - second, compare your description with the sample image descriptions provided and 
-    verify if your description structure is similar to the samples
-    - lastly, if your image description is not similar, provide another image description given the design attributes, 
-    following the description structure of the samples
-
-    Use the following format:
-    {'Your image description': image description here,
-    'Is the sentence structure of your image description similar to the sample image descriptions': 'Yes or No',
-    'Your final image description': final image description that has a similar sentence structure to the sample image descriptions,
-    'prompt': final image description
-    }
-    ''' +\
-    f'''
-    design attributes: ```{design_attributes}```
-    sample image descriptions: ```{sample_prompts}```
-    '''
     await update.message.reply_html(
                                     f'''\U0001F538 <strong>Generating {image_type}</strong> \U0001F538\n(Please wait for up to 5 mins \U0001F557)''',
                                     reply_markup = ReplyKeyboardRemove(),
                                     )
-    # get chatgpt's response
-    response = await get_completion(prompt, "gpt-3.5-turbo", 0)
-    image_prompt = eval(response)['prompt']
+    # use the text-to-image prompt returned with the proposed image designs (DESIGN_PROMPTS_ENABLED), if any
+    image_prompt = selected_image_design_dict.get('prompt')
+    if image_prompt:
+        logger.info('Using the text-to-image prompt of the image design step')
+    else:
+        # compile the prompt with a few relevant sample image descriptions, within the step's token budget
+        prompt = build_image_prompt(company, image_type, design_attributes)
+        # get chatgpt's response
+        try:
+            image_prompt = (await get_structured_completion(prompt, "gpt-3.5-turbo", 0, 'prompt', user_id = update.effective_user.id, on_queued = queue_position_notifier(update)))['prompt']
+        except ResponseParseError:
+            await reply_parse_failure(update, 'Send /choosedesign to select an image design again.')
+            return GENERATE_PROMPT_AND_IMAGE
     
     # cache generated prompt
     context.user_data['image_info']['image_prompt'] = image_prompt
@@ -872,28 +1180,23 @@ async def generate_prompt_and_image(update: Update, context: ContextTypes.DEFAUL
     # get username
     username = context.user_data['username']
     
-    client = InferenceClient(token=HF_TOKEN)
-    update_as_dict = update.to_dict()
-    update_as_json = json.dumps(update_as_dict)
-    logger.info(update_as_json)
-    logger.info(update_as_dict["message"]["from"]["first_name"]+ " "+ "sent the message of:" + update.message.text)
-    
-    # spin up another thread to await completion of huggingface API
-    image_path = f"data/image_output/{username}_output.png"
-    await txt2img(image_prompt, image_path)
-    
+    # log the update without serializing it on the event loop (full update at DEBUG only)
+    log_update(logger, update, 'generate_prompt_and_image', state = GENERATE_PROMPT_AND_IMAGE)
     
     # Send image prompt to user 
     await update.message.reply_html(
                                     f'''<strong>Text-to-Image Prompt used:</strong>\n{image_prompt}''',
                                     )
     
-    # send image to user
-    await context.bot.send_photo(
-        chat_id = context.user_data['chat_id'],
-        photo = open(image_path, "rb"),
-        write_timeout = 150
-    )
+    # generate the image candidates on the huggingface thread pool and send them to the user as they finish
+    with timed(logger, 'image', user = update.effective_user.id, state = GENERATE_PROMPT_AND_IMAGE):
+        file_ids = await generate_and_send_images(context, image_prompt, username, update.effective_user.id,
+                                                  on_queued = queue_position_notifier(update))
+    
+    # cache Telegram's file_ids of the images for re-sending without uploading
+    context.user_data['image_info']['image_file_id'] = file_ids[0]
+    context.user_data['image_info']['image_file_ids'] = file_ids
+    context.user_data['image_info']['image_file_prompt'] = image_prompt
     
     # output text template
     lst_commands = ['/editcompany - edit your company name',
@@ -908,7 +1211,7 @@ async def generate_prompt_and_image(update: Update, context: ContextTypes.DEFAUL
     # send text to user
     await update.message.reply_text(
                                     f'{output_text}',
-                                    reply_markup = ReplyKeyboardMarkup([['Generate Image Again'], ['Generate New Image: Step-by-step Process'], ['Generate New Image: Use Custom Prompt'], ['Edit Existing Image']]),
+                                    reply_markup = ReplyKeyboardMarkup([['Generate Image Again'], ['Generate Fresh Image'], ['Generate New Image: Step-by-step Process'], ['Generate New Image: Use Custom Prompt'], ['Edit Existing Image']]),
                                     )
     return RESET_CHAT
 
@@ -935,33 +1238,44 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # user request to regenerate image
     else:
         image_prompt = context.user_data['image_info']['image_prompt']
+    
+    # skip the image cache when user requests a new variation of the same prompt
+    force_fresh = update.message.text == 'Generate Fresh Image'
         
-    client = InferenceClient(token=HF_TOKEN)
-    update_as_dict = update.to_dict()
-    update_as_json = json.dumps(update_as_dict)
-    logger.info(update_as_json)
-    logger.info(update_as_dict["message"]["from"]["first_name"]+ " "+ "sent the message of:" + update.message.text)
+    # log the update without serializing it on the event loop (full update at DEBUG only)
+    log_update(logger, update, 'generate_image')
     
-    await update.message.reply_html(
-                                    f'''\U0001F538 <strong>Generating {image_type}</strong> \U0001F538\n(Please wait for up to 5 mins \U0001F557)''',
-                                    reply_markup = ReplyKeyboardRemove(),
-                                    )
+    # get Telegram's file_ids of the last images sent for this prompt, if any
+    image_file_ids = None
+    if not force_fresh and context.user_data['image_info'].get('image_file_prompt') == image_prompt:
+        image_file_ids = context.user_data['image_info'].get('image_file_ids')
+        if image_file_ids is None and context.user_data['image_info'].get('image_file_id') is not None:
+            image_file_ids = [context.user_data['image_info']['image_file_id']]
     
-    # spin up another thread to await completion of huggingface API
-    image_path = f"data/image_output/{username}_output.png"
-    await txt2img(image_prompt, image_path)
+    if image_file_ids is None:
+        await update.message.reply_html(
+                                        f'''\U0001F538 <strong>Generating {image_type}</strong> \U0001F538\n(Please wait for up to 5 mins \U0001F557)''',
+                                        reply_markup = ReplyKeyboardRemove(),
+                                        )
     
     # Send image prompt to user 
     await update.message.reply_html(
                                     f'''<strong>Text-to-Image Prompt used:</strong>\n{image_prompt}''',
                                     )
     
-    # send image to user
-    await context.bot.send_photo(
-        chat_id = context.user_data['chat_id'],
-        photo = open(image_path, "rb"),
-        write_timeout = 150,
-    )
+    # send images to user (re-send by file_id when the same images were already delivered)
+    if image_file_ids is not None:
+        file_ids = await resend_generated_images(context, image_file_ids)
+    else:
+        # generate the image candidates on the huggingface thread pool and send them to the user as they finish
+        with timed(logger, 'image', user = update.effective_user.id):
+            file_ids = await generate_and_send_images(context, image_prompt, username, update.effective_user.id,
+                                                      force_fresh = force_fresh, on_queued = queue_position_notifier(update))
+    
+    # cache Telegram's file_ids of the images for re-sending without uploading
+    context.user_data['image_info']['image_file_id'] = file_ids[0]
+    context.user_data['image_info']['image_file_ids'] = file_ids
+    context.user_data['image_info']['image_file_prompt'] = image_prompt
 
     # output text template
     lst_commands = ['/editcompany - edit your company name',
@@ -974,7 +1288,7 @@ async def generate_image(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         output_text += command_description + '\n'
     await update.message.reply_text(
                                     f'{output_text}',
-                                    reply_markup = ReplyKeyboardMarkup([['Generate Image Again'], ['Generate New Image: Step-by-step Process'], ['Generate New Image: Use Custom Prompt'], ['Edit Existing Image']]),
+                                    reply_markup = ReplyKeyboardMarkup([['Generate Image Again'], ['Generate Fresh Image'], ['Generate New Image: Step-by-step Process'], ['Generate New Image: Use Custom Prompt'], ['Edit Existing Image']]),
                                     )
     return RESET_CHAT
 
@@ -991,6 +1305,9 @@ async def quit_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "Thank you and have a nice day.\n\nSend /start for a new conversation.", reply_markup=ReplyKeyboardRemove()
     )
     
+    # stop any background work for the user
+    get_speculative_tasks().cancel(update.effective_user.id)
+    
     # delete user's cache
     for key in list(context.user_data.copy().keys()):
         del context.user_data[key]
@@ -0,0 +1,108 @@
+"""
+Pluggable image-editing backends used by the worker (worker.py) to process inpainting/outpainting jobs.
+
+A backend subclasses EditBackend and implements its abstract inpaint() and outpaint() on PIL images. StubEditBackend is a
+CPU-only stand-in for local testing: it blurs the masked region for inpainting and mirrors the edge of the
+image for outpainting. Other backends are selected with EDIT_BACKEND="package.module:ClassName".
+"""
+import abc
+import importlib
+import logging
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# fraction of the image's width/height added in the outpainting direction
+OUTPAINT_RATIO = 0.5
+
+
+class EditBackend(abc.ABC):
+    """
+    Interface of an image-editing backend. Methods are called from a worker thread and may block.
+    """
+
+    @abc.abstractmethod
+    def inpaint(self, base_image: Image.Image, mask_image: Image.Image, caption: str = None) -> Image.Image:
+        """
+        Replaces the white region of mask_image (mode 'L', same size as base_image) in base_image.
+        """
+
+    @abc.abstractmethod
+    def outpaint(self, image: Image.Image, direction: str, caption: str = None) -> Image.Image:
+        """
+        Extends image towards direction ('left', 'right', 'top' or 'bottom').
+        """
+
+
+class StubEditBackend(EditBackend):
+    """
+    CPU stand-in backend for local testing, no model involved.
+    """
+
+    def inpaint(self, base_image, mask_image, caption=None):
+        base_image = base_image.convert("RGB")
+        blurred = base_image.filter(ImageFilter.GaussianBlur(radius=max(base_image.size) // 40 + 1))
+        return Image.composite(blurred, base_image, mask_image.convert("L"))
+
+    def outpaint(self, image, direction, caption=None):
+        image = image.convert("RGB")
+        width, height = image.size
+        if direction in ("left", "right"):
+            extension = int(width * OUTPAINT_RATIO)
+            canvas = Image.new("RGB", (width + extension, height))
+            if direction == "left":
+                strip = ImageOps.mirror(image.crop((0, 0, extension, height)))
+                canvas.paste(strip, (0, 0))
+                canvas.paste(image, (extension, 0))
+            else:
+                strip = ImageOps.mirror(image.crop((width - extension, 0, width, height)))
+                canvas.paste(image, (0, 0))
+                canvas.paste(strip, (width, 0))
+        elif direction in ("top", "bottom"):
+            extension = int(height * OUTPAINT_RATIO)
+            canvas = Image.new("RGB", (width, height + extension))
+            if direction == "top":
+                strip = ImageOps.flip(image.crop((0, 0, width, extension)))
+                canvas.paste(strip, (0, 0))
+                canvas.paste(image, (0, extension))
+            else:
+                strip = ImageOps.flip(image.crop((0, height - extension, width, height)))
+                canvas.paste(image, (0, 0))
+                canvas.paste(strip, (0, height))
+        else:
+            raise ValueError(f"Unknown outpainting direction {direction}")
+        return canvas
+
+
+def mask_from_upload(base_image: Image.Image, mask_image: Image.Image, threshold: int = 40) -> Image.Image:
+    """
+    Returns a binary mask (mode 'L', 255 = edit) the size of base_image.
+
+    Uploads that are already black/white masks are used as is, brush-edited copies of the base image are
+    diffed against it.
+    """
+    if mask_image.size != base_image.size:
+        mask_image = mask_image.resize(base_image.size, Image.NEAREST)
+    grayscale = mask_image.convert("L")
+    if len(grayscale.getcolors(256) or []) <= 2 and set(grayscale.getextrema()) <= {0, 255}:
+        return grayscale
+    difference = ImageChops.difference(base_image.convert("RGB"), mask_image.convert("RGB")).convert("L")
+    return difference.point(lambda value: 255 if value > threshold else 0)
+
+
+def load_edit_backend(name: str = "stub") -> EditBackend:
+    """
+    Returns the backend registered as name, or imports it from a "package.module:ClassName" path.
+
+    Raises TypeError when the class is not an EditBackend or leaves one of its methods unimplemented.
+    """
+    if name == "stub":
+        return StubEditBackend()
+    module_name, _, class_name = name.partition(":")
+    backend_class = getattr(importlib.import_module(module_name), class_name)
+    if not (isinstance(backend_class, type) and issubclass(backend_class, EditBackend)):
+        raise TypeError(f"Edit backend {name} is not an EditBackend subclass")
+    # instantiating fails here, not on the first job, if inpaint() or outpaint() is missing
+    backend = backend_class()
+    logger.info(f"Loaded edit backend {name}")
+    return backend
@@ -0,0 +1,71 @@
+"""
+Helpers for moving generated images between backends and Telegram in memory.
+
+Images are encoded once into a BytesIO buffer that can be re-read (seek(0)) for caching and delivery.
+Writing to disk only happens in the opt-in archive mode (IMAGE_ARCHIVE_ENABLED=true).
+"""
+import io
+import logging
+import os
+import uuid
+from datetime import datetime
+from .services import get_config
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# format/quality that generated images are encoded with before delivery (PNG, WEBP or JPEG)
+IMAGE_OUTPUT_FORMAT = (config.get("IMAGE_OUTPUT_FORMAT") or "PNG").upper()
+IMAGE_OUTPUT_QUALITY = int(config.get("IMAGE_OUTPUT_QUALITY") or 90)
+IMAGE_ARCHIVE_ENABLED = (config.get("IMAGE_ARCHIVE_ENABLED") or "false").lower() == "true"
+IMAGE_ARCHIVE_DIR = config.get("IMAGE_ARCHIVE_DIR") or "data/image_output"
+
+FORMAT_EXTENSIONS = {"PNG": "png", "WEBP": "webp", "JPEG": "jpg"}
+
+
+def image_extension(fmt: str = IMAGE_OUTPUT_FORMAT) -> str:
+    return FORMAT_EXTENSIONS.get(fmt.upper(), fmt.lower())
+
+
+def encode_image(image, fmt: str = IMAGE_OUTPUT_FORMAT, quality: int = IMAGE_OUTPUT_QUALITY) -> io.BytesIO:
+    """
+    Encodes a PIL image into a BytesIO buffer positioned at the start.
+    """
+    fmt = fmt.upper()
+    buffer = io.BytesIO()
+    if fmt == "PNG":
+        image.save(buffer, format="PNG", optimize=True)
+    elif fmt == "JPEG":
+        # JPEG has no alpha channel
+        image.convert("RGB").save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        image.save(buffer, format=fmt, quality=quality)
+    buffer.name = f"image.{image_extension(fmt)}"  # lets Telegram infer the file type
+    buffer.seek(0)
+    return buffer
+
+
+def buffer_from_bytes(data: bytes, fmt: str = IMAGE_OUTPUT_FORMAT) -> io.BytesIO:
+    buffer = io.BytesIO(data)
+    buffer.name = f"image.{image_extension(fmt)}"
+    return buffer
+
+
+@run_in_threadpool_decorator("disk_io")
+def archive_image(data: bytes, prefix: str, ext: str = None) -> str:
+    """
+    Saves a copy of the image under IMAGE_ARCHIVE_DIR with a unique name and returns its path.
+    """
+    os.makedirs(IMAGE_ARCHIVE_DIR, exist_ok=True)
+    timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S")
+    image_path = os.path.join(
+        IMAGE_ARCHIVE_DIR,
+        f"{prefix}_{timestamp_str}_{uuid.uuid4().hex[:8]}.{ext or image_extension()}",
+    )
+    with open(image_path, "wb") as f:
+        f.write(data)
+    logger.info(f"Archived image to {image_path}")
+    return image_path
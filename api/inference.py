@@ -0,0 +1,121 @@
+"""
+Long-lived HuggingFace text-to-image backends.
+
+One ImageBackend is kept per model for the lifetime of the process. All backends share a pooled keep-alive session,
+so generating an image no longer pays for client construction and a TLS handshake on every request.
+huggingface_hub is imported when the first backend is created rather than with this module.
+
+huggingface_hub < 1.0 uses requests and is given a session sized by HF_POOL_SIZE through configure_http_backend().
+Later versions keep their own pooled httpx client and have no such hook, so their default session is used as is.
+"""
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from .services import get_config, startup_phase
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+HF_INFERENCE_URL = "https://api-inference.huggingface.co"
+HF_POOL_SIZE = int(config.get("HF_POOL_SIZE") or 10)
+# default text-to-image model, None lets huggingface_hub pick its recommended model
+HF_TXT2IMG_MODEL = config.get("HF_TXT2IMG_MODEL") or None
+
+
+# build one pooled keep-alive session for huggingface_hub instead of its default adapter sizes
+def _backend_factory() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=HF_POOL_SIZE, pool_maxsize=HF_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class ImageBackend:
+    """
+    Text-to-image backend bound to one model, reusing the same InferenceClient for every request.
+    """
+
+    def __init__(self, model: str = None, token: str = None) -> None:
+        from huggingface_hub import InferenceClient
+
+        self.model = model
+        self.client = InferenceClient(model=model, token=token)
+
+    def text_to_image(self, prompt: str, **kwargs):
+        """
+        Generates an image (PIL.Image) from prompt, blocking the calling thread.
+        """
+        return self.client.text_to_image(prompt=prompt, **kwargs)
+
+    @run_in_threadpool_decorator("hugging_face_threads")
+    def atext_to_image(self, prompt: str, **kwargs):
+        """
+        Awaitable variant of text_to_image, run on the shared hugging_face_threads pool.
+        """
+        return self.text_to_image(prompt, **kwargs)
+
+    def warm_up(self) -> None:
+        """
+        Opens the pooled HTTPS connection (and wakes the model when known) ahead of the first request.
+        """
+        try:
+            # get_model_status() was removed in huggingface_hub 1.0, opening the connection is all that is left
+            if self.model and hasattr(self.client, "get_model_status"):
+                status = self.client.get_model_status(self.model)
+                logger.info(f"Warmed up {self.model}: {status}")
+            else:
+                from huggingface_hub import get_session
+
+                get_session().head(HF_INFERENCE_URL, timeout=10)
+                logger.info(f"Warmed up HuggingFace inference connection for {self.model or 'default model'}")
+        except Exception as e:
+            # warm-up is best effort, the first request will retry the connection
+            logger.warning(f"Warm-up of {self.model or 'default model'} failed: {e}")
+
+    @run_in_threadpool_decorator("hugging_face_threads")
+    def awarm_up(self) -> None:
+        return self.warm_up()
+
+
+def _configure_http_session() -> None:
+    try:
+        from huggingface_hub import configure_http_backend
+    except ImportError:
+        # huggingface_hub >= 1.0 pools its own httpx connections and has no session hook
+        logger.info("huggingface_hub has no configure_http_backend(), using its default pooled session")
+        return
+    configure_http_backend(backend_factory=_backend_factory)
+
+
+# process-wide backends keyed by model
+_image_backends = {}
+
+
+def get_image_backend(model: str = HF_TXT2IMG_MODEL) -> ImageBackend:
+    backend = _image_backends.get(model)
+    if backend is None:
+        with startup_phase("huggingface backend"):
+            if not _image_backends:
+                _configure_http_session()
+            backend = ImageBackend(model=model, token=config["HF_API_KEY"])
+        _image_backends[model] = backend
+    return backend
+
+
+async def warm_up_image_backends(models: list = None) -> None:
+    """
+    Creates and warms up the backends of models (default model when not given), e.g. from Application post_init.
+
+    Failures are only logged: the bot still starts and the first request creates the backend again.
+    """
+    for model in models or [HF_TXT2IMG_MODEL]:
+        try:
+            backend = get_image_backend(model)
+        except Exception as e:
+            logger.warning(f"Could not create the backend of {model or 'default model'}: {e}")
+            continue
+        await backend.awarm_up()
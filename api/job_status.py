@@ -0,0 +1,155 @@
+"""
+Job-state store for queued image-editing jobs, shared by the bot (submission side) and worker.py.
+
+Each job (keyed by its trace id) moves through queued -> running -> done -> delivered, or failed, with a timestamp
+per stage. Per-stage latency histograms (enqueue->start, start->done, done->delivered) are computed from the
+stored timestamps, so they cover every worker writing to the same store (JOB_STATUS_PATH).
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from .services import get_config
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_PATH = config.get("JOB_STATUS_PATH") or "data/jobs.sqlite3"
+
+# upper bounds (seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+
+# stage name -> (start column, end column)
+STAGES = {
+    "enqueue_to_start": ("queued_at", "started_at"),
+    "start_to_done": ("started_at", "done_at"),
+    "done_to_delivered": ("done_at", "delivered_at"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    trace_id TEXT PRIMARY KEY,
+    job_type TEXT,
+    user_id INTEGER,
+    chat_id INTEGER,
+    state TEXT NOT NULL,
+    queued_at REAL,
+    started_at REAL,
+    done_at REAL,
+    delivered_at REAL,
+    failed_at REAL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_user_id ON jobs (user_id, queued_at);
+"""
+
+
+class JobStatusStore:
+    """
+    SQLite (WAL mode) table of job states, safe to share between the bot and worker processes.
+    """
+
+    def __init__(self, filepath: str = JOB_STATUS_PATH) -> None:
+        self.filepath = filepath
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(filepath) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def _execute(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @run_in_threadpool_decorator("disk_io")
+    def record_queued(self, job) -> None:
+        """
+        Records a job (api.jobs.EditJobMessage) right before it is submitted to the queue.
+        """
+        self._execute(
+            "INSERT OR REPLACE INTO jobs (trace_id, job_type, user_id, chat_id, state, queued_at) "
+            "VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job.trace_id, job.job_type, job.user_id, job.chat_id, time.time()),
+        )
+
+    def _set_state(self, trace_id: str, state: str, column: str, error: str = None) -> None:
+        self._execute(
+            f"UPDATE jobs SET state = ?, {column} = ?, error = COALESCE(?, error) WHERE trace_id = ?",
+            (state, time.time(), error, trace_id),
+        )
+
+    @run_in_threadpool_decorator("disk_io")
+    def mark_running(self, trace_id: str) -> None:
+        self._set_state(trace_id, "running", "started_at")
+
+    @run_in_threadpool_decorator("disk_io")
+    def mark_done(self, trace_id: str) -> None:
+        self._set_state(trace_id, "done", "done_at")
+
+    @run_in_threadpool_decorator("disk_io")
+    def mark_delivered(self, trace_id: str) -> None:
+        self._set_state(trace_id, "delivered", "delivered_at")
+
+    @run_in_threadpool_decorator("disk_io")
+    def mark_failed(self, trace_id: str, error: str) -> None:
+        self._set_state(trace_id, "failed", "failed_at", error=error[:500])
+
+    @run_in_threadpool_decorator("disk_io")
+    def latest_jobs(self, user_id: int, limit: int = 5) -> list:
+        """
+        Returns the user's most recent jobs as dictionaries, newest first.
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? ORDER BY queued_at DESC LIMIT ?",
+                (user_id, limit),
+            )
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    @run_in_threadpool_decorator("disk_io")
+    def latency_histograms(self, since: float = None) -> dict:
+        """
+        Returns {stage: {"count", "p50", "p95", "buckets": {"<=1s": n, ..., ">600s": n}}} for jobs queued after since.
+        """
+        since = since or 0
+        histograms = {}
+        for stage, (start_column, end_column) in STAGES.items():
+            rows = self._execute(
+                f"SELECT {end_column} - {start_column} FROM jobs "
+                f"WHERE {start_column} IS NOT NULL AND {end_column} IS NOT NULL AND queued_at >= ?",
+                (since,),
+            )
+            durations = sorted(row[0] for row in rows)
+            buckets = {f"<={bound}s": 0 for bound in LATENCY_BUCKETS}
+            buckets[f">{LATENCY_BUCKETS[-1]}s"] = 0
+            for duration in durations:
+                for bound in LATENCY_BUCKETS:
+                    if duration <= bound:
+                        buckets[f"<={bound}s"] += 1
+                        break
+                else:
+                    buckets[f">{LATENCY_BUCKETS[-1]}s"] += 1
+            histograms[stage] = {
+                "count": len(durations),
+                "p50": round(durations[len(durations) // 2], 2) if durations else None,
+                "p95": round(durations[int(len(durations) * 0.95)], 2) if durations else None,
+                "buckets": buckets,
+            }
+        return histograms
+
+
+# process-wide store, created on first use
+_job_status_store = None
+
+
+def get_job_status_store() -> JobStatusStore:
+    global _job_status_store
+    if _job_status_store is None:
+        _job_status_store = JobStatusStore()
+    return _job_status_store
@@ -0,0 +1,382 @@
+"""
+Job submission queue for image-editing jobs.
+
+SQSBatchSubmitter coalesces messages submitted within a short flush window into SendMessageBatch calls
+(up to 10 messages per batch), acknowledges each message back to the awaiting handler with its SQS MessageId,
+and retries entries that failed on the service side with exponential backoff.
+LocalJobQueue is an in-process stand-in with the same submit() interface (set SQS_URL=local), for tests only: its
+messages live in the bot's memory, so worker.py cannot consume them and their /status stays "queued".
+SQSJobReceiver is the consuming side used by the worker: long polling, visibility extension and batch deletion.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from .services import get_config, startup_phase
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+SQS_REGION = config.get("SQS_REGION") or "ap-southeast-1"
+# set to target a local SQS-compatible stand-in (e.g. ElasticMQ or LocalStack)
+SQS_ENDPOINT_URL = config.get("SQS_ENDPOINT_URL") or None
+SQS_FLUSH_WINDOW = float(config.get("SQS_FLUSH_WINDOW") or 0.05)
+SQS_MAX_RETRIES = int(config.get("SQS_MAX_RETRIES") or 3)
+SQS_RETRY_BACKOFF = float(config.get("SQS_RETRY_BACKOFF") or 0.2)
+# limits of SendMessageBatch
+SQS_MAX_BATCH_SIZE = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+
+
+def make_sqs_client(region_name: str = SQS_REGION, max_pool_connections: int = 10):
+    # boto3 is slow to import, so it is only loaded once sqs is needed
+    with startup_phase("sqs client"):
+        import boto3
+        from botocore.config import Config
+
+        return boto3.client(
+            "sqs",
+            region_name=region_name,
+            endpoint_url=SQS_ENDPOINT_URL,
+            config=Config(max_pool_connections=max_pool_connections),
+        )
+
+
+class JobSubmissionError(RuntimeError):
+    """Raised to the awaiting handler when its message could not be queued."""
+
+
+class _PendingMessage:
+    def __init__(self, body: str, future: asyncio.Future) -> None:
+        self.id = uuid.uuid4().hex
+        self.body = body
+        self.size = len(body.encode("utf-8"))
+        self.future = future
+        self.attempts = 0
+
+
+class SQSBatchSubmitter:
+    """
+    Coalesces submitted messages into SendMessageBatch calls on a background task.
+    """
+
+    def __init__(
+        self,
+        queue_url: str,
+        region_name: str = SQS_REGION,
+        flush_window: float = SQS_FLUSH_WINDOW,
+        max_retries: int = SQS_MAX_RETRIES,
+        retry_backoff: float = SQS_RETRY_BACKOFF,
+    ) -> None:
+        self.queue_url = queue_url
+        self.region_name = region_name
+        self.flush_window = flush_window
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._sqs_client = None
+        self._queue = None
+        self._carry = None
+        self._flush_task = None
+        self._send_tasks = set()
+        self.batches_sent = 0
+        self.messages_sent = 0
+        self.messages_retried = 0
+        self.messages_failed = 0
+
+    @property
+    def sqs_client(self):
+        if self._sqs_client is None:
+            self._sqs_client = make_sqs_client(self.region_name)
+        return self._sqs_client
+
+    async def submit(self, body: str) -> str:
+        """
+        Queues body for the next batch and waits until SQS acknowledges it, returning its MessageId.
+        """
+        if self._flush_task is None or self._flush_task.done():
+            self._queue = asyncio.Queue()
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+        message = _PendingMessage(body, asyncio.get_running_loop().create_future())
+        if message.size > SQS_MAX_BATCH_BYTES:
+            raise JobSubmissionError(f"Message of {message.size} bytes exceeds the SQS limit")
+        await self._queue.put(message)
+        return await message.future
+
+    async def _next_message(self, timeout: float = None):
+        if self._carry is not None:
+            message, self._carry = self._carry, None
+            return message
+        if timeout is None:
+            return await self._queue.get()
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    async def _flush_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._next_message()]
+            batch_bytes = batch[0].size
+            deadline = loop.time() + self.flush_window
+            while len(batch) < SQS_MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    message = await self._next_message(timeout)
+                except asyncio.TimeoutError:
+                    break
+                if batch_bytes + message.size > SQS_MAX_BATCH_BYTES:
+                    # keep for the next batch
+                    self._carry = message
+                    break
+                batch.append(message)
+                batch_bytes += message.size
+
+            # send without blocking the collection of the next batch
+            task = loop.create_task(self._send_with_retries(batch))
+            self._send_tasks.add(task)
+            task.add_done_callback(self._send_tasks.discard)
+
+    @run_in_threadpool_decorator("aws_io")
+    def _send_batch(self, batch: list) -> dict:
+        return self.sqs_client.send_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[{"Id": message.id, "MessageBody": message.body} for message in batch],
+        )
+
+    async def _send_with_retries(self, batch: list) -> None:
+        while batch:
+            for message in batch:
+                message.attempts += 1
+            try:
+                response = await self._send_batch(batch)
+            except Exception as e:
+                logger.warning(f"SendMessageBatch of {len(batch)} messages failed: {e}")
+                response = {
+                    "Failed": [
+                        {"Id": message.id, "SenderFault": False, "Message": str(e)}
+                        for message in batch
+                    ]
+                }
+            self.batches_sent += 1
+
+            messages = {message.id: message for message in batch}
+            for entry in response.get("Successful", []):
+                message = messages[entry["Id"]]
+                self.messages_sent += 1
+                if not message.future.done():
+                    message.future.set_result(entry["MessageId"])
+
+            retry_batch = []
+            for entry in response.get("Failed", []):
+                message = messages[entry["Id"]]
+                if entry.get("SenderFault") or message.attempts > self.max_retries:
+                    self.messages_failed += 1
+                    if not message.future.done():
+                        message.future.set_exception(
+                            JobSubmissionError(f"{entry.get('Code', 'Error')}: {entry.get('Message')}")
+                        )
+                else:
+                    self.messages_retried += 1
+                    retry_batch.append(message)
+
+            batch = retry_batch
+            if batch:
+                attempt = max(message.attempts for message in batch)
+                # exponential backoff with jitter
+                await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+    def stats(self) -> dict:
+        return {
+            "batches_sent": self.batches_sent,
+            "messages_sent": self.messages_sent,
+            "messages_retried": self.messages_retried,
+            "messages_failed": self.messages_failed,
+            "avg_batch_size": round(self.messages_sent / self.batches_sent, 2) if self.batches_sent else 0.0,
+        }
+
+    async def aclose(self) -> None:
+        """
+        Sends whatever is still queued, then stops the background task.
+        """
+        if self._flush_task is None:
+            return
+        while self._carry is not None or (self._queue is not None and not self._queue.empty()):
+            await asyncio.sleep(self.flush_window)
+        # let the batch being collected reach its send task
+        await asyncio.sleep(self.flush_window)
+        if self._send_tasks:
+            await asyncio.gather(*self._send_tasks, return_exceptions=True)
+        self._flush_task.cancel()
+        self._flush_task = None
+
+
+class SQSJobReceiver:
+    """
+    Consumes messages from an SQS queue: long polling, visibility timeout extension and batched deletion.
+    """
+
+    def __init__(
+        self,
+        queue_url: str,
+        region_name: str = SQS_REGION,
+        wait_time: int = 20,
+        delete_window: float = 1.0,
+    ) -> None:
+        self.queue_url = queue_url
+        self.wait_time = wait_time
+        self.delete_window = delete_window
+        self.sqs_client = make_sqs_client(region_name)
+        self._delete_queue = None
+        self._delete_task = None
+        self.messages_received = 0
+        self.messages_deleted = 0
+
+    @run_in_threadpool_decorator("aws_io")
+    def _receive(self, max_messages: int, visibility_timeout: int) -> list:
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=max(1, min(max_messages, SQS_MAX_BATCH_SIZE)),
+            WaitTimeSeconds=self.wait_time,
+            VisibilityTimeout=visibility_timeout,
+            AttributeNames=["ApproximateReceiveCount"],
+        )
+        return response.get("Messages", [])
+
+    async def receive(self, max_messages: int, visibility_timeout: int) -> list:
+        """
+        Long polls for up to max_messages messages (at most 10).
+        """
+        messages = await self._receive(max_messages, visibility_timeout)
+        self.messages_received += len(messages)
+        return messages
+
+    @run_in_threadpool_decorator("aws_io")
+    def extend_visibility(self, receipt_handle: str, visibility_timeout: int) -> None:
+        self.sqs_client.change_message_visibility(
+            QueueUrl=self.queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=visibility_timeout,
+        )
+
+    async def delete(self, receipt_handle: str) -> None:
+        """
+        Queues a processed message for the next DeleteMessageBatch call.
+        """
+        if self._delete_task is None or self._delete_task.done():
+            self._delete_queue = asyncio.Queue()
+            self._delete_task = asyncio.get_running_loop().create_task(self._delete_loop())
+        await self._delete_queue.put(receipt_handle)
+
+    @run_in_threadpool_decorator("aws_io")
+    def _delete_batch(self, receipt_handles: list) -> dict:
+        return self.sqs_client.delete_message_batch(
+            QueueUrl=self.queue_url,
+            Entries=[
+                {"Id": str(index), "ReceiptHandle": receipt_handle}
+                for index, receipt_handle in enumerate(receipt_handles)
+            ],
+        )
+
+    async def _flush_deletes(self, receipt_handles: list) -> None:
+        try:
+            response = await self._delete_batch(receipt_handles)
+        except Exception as e:
+            # messages reappear after their visibility timeout and are processed again
+            logger.warning(f"DeleteMessageBatch of {len(receipt_handles)} messages failed: {e}")
+            return
+        self.messages_deleted += len(response.get("Successful", []))
+        for entry in response.get("Failed", []):
+            logger.warning(f"Failed to delete message: {entry}")
+
+    async def _delete_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            receipt_handles = [await self._delete_queue.get()]
+            deadline = loop.time() + self.delete_window
+            while len(receipt_handles) < SQS_MAX_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    receipt_handles.append(await asyncio.wait_for(self._delete_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush_deletes(receipt_handles)
+
+    def stats(self) -> dict:
+        return {
+            "messages_received": self.messages_received,
+            "messages_deleted": self.messages_deleted,
+        }
+
+    async def aclose(self) -> None:
+        """
+        Deletes the messages still waiting for a batch, then stops the background task.
+        """
+        if self._delete_task is None:
+            return
+        self._delete_task.cancel()
+        receipt_handles = []
+        while not self._delete_queue.empty():
+            receipt_handles.append(self._delete_queue.get_nowait())
+        for start in range(0, len(receipt_handles), SQS_MAX_BATCH_SIZE):
+            await self._flush_deletes(receipt_handles[start : start + SQS_MAX_BATCH_SIZE])
+        self._delete_task = None
+
+
+class LocalJobQueue:
+    """
+    In-process stand-in for SQS. Submitted messages are kept in memory and can be read back with receive() by code
+    running in the same process (tests); worker.py only consumes SQS.
+    """
+
+    def __init__(self) -> None:
+        self.messages = asyncio.Queue()
+        self.messages_sent = 0
+
+    async def submit(self, body: str) -> str:
+        message_id = uuid.uuid4().hex
+        await self.messages.put({"MessageId": message_id, "Body": body})
+        self.messages_sent += 1
+        return message_id
+
+    async def receive(self, max_messages: int = 10, wait_time: float = 0) -> list:
+        messages = []
+        if wait_time <= 0 and self.messages.empty():
+            return messages
+        try:
+            messages.append(await asyncio.wait_for(self.messages.get(), wait_time or None))
+        except asyncio.TimeoutError:
+            return messages
+        while len(messages) < max_messages and not self.messages.empty():
+            messages.append(self.messages.get_nowait())
+        return messages
+
+    def stats(self) -> dict:
+        return {"messages_sent": self.messages_sent, "queued": self.messages.qsize()}
+
+    async def aclose(self) -> None:
+        pass
+
+
+# process-wide submitter shared by the inpainting and outpainting handlers
+_job_submitter = None
+
+
+def get_job_submitter():
+    global _job_submitter
+    if _job_submitter is None:
+        if config.get("SQS_URL") == "local":
+            logger.warning("SQS_URL=local: image-editing jobs stay in this process and are not processed by worker.py")
+            _job_submitter = LocalJobQueue()
+        else:
+            _job_submitter = SQSBatchSubmitter(queue_url=config["SQS_URL"])
+    return _job_submitter
+
+
+async def close_job_submitter() -> None:
+    if _job_submitter is not None:
+        await _job_submitter.aclose()
@@ -0,0 +1,104 @@
+"""
+Compact, versioned message schema for image-editing jobs sent to the SQS queue.
+
+Only the fields the worker needs are shipped (instead of the whole serialized telegram Update), using short keys.
+Messages are encoded as JSON by default, or msgpack (base64 wrapped, as SQS bodies are text) when
+JOB_MESSAGE_FORMAT=msgpack and the msgpack package is installed. decode_job() accepts either format.
+"""
+import base64
+import json
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+from .services import get_config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# get config
+config = get_config()
+
+JOB_MESSAGE_VERSION = 1
+JOB_MESSAGE_FORMAT = (config.get("JOB_MESSAGE_FORMAT") or "json").lower()
+MSGPACK_PREFIX = "m1:"
+
+# field name -> short key on the wire
+_WIRE_KEYS = {
+    "version": "v",
+    "job_type": "t",
+    "chat_id": "c",
+    "user_id": "u",
+    "base_image_s3_key": "b",
+    "mask_image_s3_key": "m",
+    "direction": "d",
+    "caption": "p",
+    "trace_id": "id",
+}
+_FIELD_NAMES = {short: name for name, short in _WIRE_KEYS.items()}
+
+
+class JobMessageError(ValueError):
+    """Raised when a job message cannot be decoded or has an unsupported version."""
+
+
+@dataclass
+class EditJobMessage:
+    job_type: str  # 'inpainting' or 'outpainting'
+    chat_id: int
+    user_id: int
+    base_image_s3_key: str
+    mask_image_s3_key: Optional[str] = None
+    direction: Optional[str] = None  # outpainting direction: left/right/top/bottom
+    caption: Optional[str] = None
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    version: int = JOB_MESSAGE_VERSION
+
+    def to_wire(self) -> dict:
+        # drop empty optional fields to keep the message small
+        return {
+            _WIRE_KEYS[name]: value
+            for name, value in self.__dict__.items()
+            if value is not None
+        }
+
+    @classmethod
+    def from_wire(cls, data: dict) -> "EditJobMessage":
+        version = data.get("v")
+        if version != JOB_MESSAGE_VERSION:
+            raise JobMessageError(f"Unsupported job message version {version}")
+        try:
+            return cls(**{_FIELD_NAMES[key]: value for key, value in data.items() if key in _FIELD_NAMES})
+        except TypeError as e:
+            raise JobMessageError(f"Invalid job message: {e}") from e
+
+
+def encode_job(job: EditJobMessage, fmt: str = JOB_MESSAGE_FORMAT) -> str:
+    """
+    Serializes a job into an SQS message body.
+    """
+    if fmt == "msgpack" and msgpack is not None:
+        packed = msgpack.packb(job.to_wire(), use_bin_type=True)
+        return MSGPACK_PREFIX + base64.b64encode(packed).decode("ascii")
+    return json.dumps(job.to_wire(), separators=(",", ":"), ensure_ascii=False)
+
+
+def decode_job(body: str) -> EditJobMessage:
+    """
+    Deserializes an SQS message body produced by encode_job().
+    """
+    try:
+        if body.startswith(MSGPACK_PREFIX):
+            if msgpack is None:
+                raise JobMessageError("msgpack job message received but msgpack is not installed")
+            data = msgpack.unpackb(base64.b64decode(body[len(MSGPACK_PREFIX):]), raw=False)
+        else:
+            data = json.loads(body)
+    except (ValueError, TypeError) as e:
+        if isinstance(e, JobMessageError):
+            raise
+        raise JobMessageError(f"Undecodable job message: {e}") from e
+    if not isinstance(data, dict):
+        raise JobMessageError("Job message is not an object")
+    return EditJobMessage.from_wire(data)
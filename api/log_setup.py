@@ -0,0 +1,243 @@
+"""
+Non-blocking, sampled and structured logging for the bots and the worker.
+
+configure_logging() replaces logging.basicConfig(): handlers only put records on a bounded queue and a background
+QueueListener thread formats and writes them, so the event loop never waits on the console or on serialization.
+Messages are formatted in the writer thread, so arguments like LazyJson(update.to_dict) are only serialized when
+the record is written. Records that find the queue full are dropped (and counted) rather than blocking.
+
+Settings in .env:
+- LOG_LEVEL: level of the root logger (default INFO)
+- LOG_LEVELS: levels of specific loggers, e.g. "telegram.ext:DEBUG,huggingface_hub:WARNING"
+- LOG_FORMAT: "text" (default) or "json", one object per line with the user, state, step and duration_ms fields
+- LOG_SAMPLING: share of records below WARNING kept per logger, e.g. "telegram.ext:0.1,api.conversation:0.5"
+- LOG_QUEUE_SIZE: records waiting for the writer thread before new ones are dropped (default 10000)
+"""
+import atexit
+import contextlib
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from .services import get_config
+
+logger = logging.getLogger(__name__)
+
+TEXT_FORMAT = "%(asctime)s - %(processName)s - %(threadName)s - [%(thread)d] - %(name)s - %(levelname)s - %(message)s"
+# structured fields handlers attach with extra=log_fields(...)
+STRUCTURED_FIELDS = ("user", "state", "step", "duration_ms")
+
+
+def _parse_mapping(value: str, convert) -> dict:
+    mapping = {}
+    for item in (value or "").split(","):
+        name, _, setting = item.strip().rpartition(":")
+        if name and setting:
+            try:
+                mapping[name] = convert(setting)
+            except ValueError:
+                logger.warning(f"Ignoring invalid logging setting {item!r}")
+    return mapping
+
+
+def _level(value: str) -> int:
+    level = logging.getLevelName(value.strip().upper())
+    if not isinstance(level, int):
+        raise ValueError(value)
+    return level
+
+
+class LazyJson:
+    """
+    Serializes the value returned by factory (e.g. update.to_dict) to JSON only when the record is written.
+    """
+
+    __slots__ = ("factory",)
+
+    def __init__(self, factory) -> None:
+        self.factory = factory
+
+    def __str__(self) -> str:
+        return json.dumps(self.factory(), default=str)
+
+
+def log_fields(user=None, state=None, step=None, duration: float = None) -> dict:
+    """
+    Returns the extra= fields of a structured record (duration in seconds, written as duration_ms).
+    """
+    fields = {"user": user, "state": state, "step": step}
+    if duration is not None:
+        fields["duration_ms"] = round(duration * 1000, 1)
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+def log_update(log: logging.Logger, update, step: str, state=None) -> None:
+    """
+    Logs that a handler received update, with the full update as JSON at DEBUG only.
+    """
+    if not log.isEnabledFor(logging.INFO):
+        return
+    user = update.effective_user.id if update.effective_user else None
+    log.info("Received update %s", update.update_id, extra=log_fields(user=user, state=state, step=step))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("%s", LazyJson(update.to_dict), extra=log_fields(user=user, state=state, step=step))
+
+
+@contextlib.contextmanager
+def timed(log: logging.Logger, step: str, message: str = None, user=None, state=None):
+    """
+    Logs message (default "<step> done") with the duration of the enclosed block, or a warning if it fails.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        log.warning(f"{step} failed: {e}", extra=log_fields(user, state, step, time.perf_counter() - started))
+        raise
+    log.info(message or f"{step} done", extra=log_fields(user, state, step, time.perf_counter() - started))
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps the given share of records below WARNING per logger (longest matching logger name prefix).
+    """
+
+    def __init__(self, rates: dict) -> None:
+        super().__init__()
+        self.rates = rates
+        self._rate_of = {}
+        self.sampled_out = 0
+
+    def _rate(self, name: str) -> float:
+        rate = self._rate_of.get(name)
+        if rate is None:
+            rate = 1.0
+            prefix = name
+            while prefix:
+                if prefix in self.rates:
+                    rate = self.rates[prefix]
+                    break
+                prefix = prefix.rpartition(".")[0]
+            self._rate_of[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the writer thread and drops records when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue) -> None:
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the record is consumed in this process, so msg, args and exc_info are kept for the writer thread
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = " ".join(
+            f"{field}={getattr(record, field)}" for field in STRUCTURED_FIELDS if getattr(record, field, None) is not None
+        )
+        return f"{text} [{fields}]" if fields else text
+
+
+# process-wide logging state, set up by configure_logging()
+_listener = None
+_queue_handler = None
+_sampling_filter = None
+_configure_lock = threading.Lock()
+
+
+def configure_logging() -> None:
+    """
+    Routes all logging through the queue to a background writer thread, configured from .env (once per process).
+    """
+    global _listener, _queue_handler, _sampling_filter
+    with _configure_lock:
+        if _listener is not None:
+            return
+        config = get_config()
+
+        stream_handler = logging.StreamHandler()
+        if (config.get("LOG_FORMAT") or "text").lower() == "json":
+            stream_handler.setFormatter(JsonFormatter())
+        else:
+            stream_handler.setFormatter(TextFormatter(TEXT_FORMAT))
+
+        log_queue = queue.Queue(maxsize=int(config.get("LOG_QUEUE_SIZE") or 10000))
+        _queue_handler = NonBlockingQueueHandler(log_queue)
+        _sampling_filter = SamplingFilter(_parse_mapping(config.get("LOG_SAMPLING"), float))
+        _queue_handler.addFilter(_sampling_filter)
+
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(_level(config.get("LOG_LEVEL") or "INFO"))
+        for name, level in _parse_mapping(config.get("LOG_LEVELS"), _level).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """
+    Writes the records still queued and stops the writer thread.
+    """
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            logging.getLogger().removeHandler(_queue_handler)
+
+
+def logging_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "sampled_out": _sampling_filter.sampled_out,
+    }
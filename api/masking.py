@@ -0,0 +1,115 @@
+"""
+Derives inpainting masks from the brush-edited copy of a base photo that users send in Telegram.
+
+The brushed photo is compared with the base photo pixel by pixel (NumPy): pixels whose colour moved further than
+MASK_COLOR_THRESHOLD are marked, after a light blur of both images so JPEG artifacts around edges don't count as
+brush strokes. The mask is then cleaned up morphologically (opening drops speckles, closing fills gaps between
+strokes), grown by MASK_DILATION px to cover the stroke edges, and encoded as a 1-bit PNG.
+"""
+import io
+import logging
+import numpy as np
+from .services import get_config
+from PIL import Image, ImageFilter
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# euclidean RGB distance (0-441) above which a pixel counts as brushed
+MASK_COLOR_THRESHOLD = float(config.get("MASK_COLOR_THRESHOLD") or 48)
+# blur radius applied to both images before diffing, absorbs JPEG artifacts
+MASK_ARTIFACT_RADIUS = float(config.get("MASK_ARTIFACT_RADIUS") or 1.5)
+# size (px) of the square structuring element used for the opening/closing cleanup
+MASK_KERNEL_SIZE = int(config.get("MASK_KERNEL_SIZE") or 5)
+# px the cleaned mask is grown by
+MASK_DILATION = int(config.get("MASK_DILATION") or 4)
+# fraction of pixels that must be near black/white for an upload to be taken as a ready-made mask
+BINARY_UPLOAD_RATIO = 0.98
+
+
+def _shifted_reduce(mask: np.ndarray, size: int, reduce) -> np.ndarray:
+    # combines every shift of mask within a size x size window with reduce (np.logical_or/and)
+    if size <= 1:
+        return mask
+    radius = size // 2
+    padded = np.pad(mask, radius, mode="edge")
+    height, width = mask.shape
+    # separable: a square window is a horizontal pass followed by a vertical pass
+    horizontal = mask
+    for dx in range(-radius, radius + 1):
+        if dx:
+            horizontal = reduce(horizontal, padded[radius : radius + height, radius + dx : radius + dx + width])
+    padded = np.pad(horizontal, radius, mode="edge")
+    result = horizontal
+    for dy in range(-radius, radius + 1):
+        if dy:
+            result = reduce(result, padded[radius + dy : radius + dy + height, radius : radius + width])
+    return result
+
+
+def _binary_ratio(grayscale: np.ndarray) -> float:
+    # fraction of near black/white pixels
+    return float(np.mean((grayscale < 32) | (grayscale > 223)))
+
+
+def dilate(mask: np.ndarray, size: int) -> np.ndarray:
+    return _shifted_reduce(mask, size, np.logical_or)
+
+
+def erode(mask: np.ndarray, size: int) -> np.ndarray:
+    return _shifted_reduce(mask, size, np.logical_and)
+
+
+def compute_mask(
+    base_image: Image.Image,
+    brushed_image: Image.Image,
+    threshold: float = MASK_COLOR_THRESHOLD,
+    artifact_radius: float = MASK_ARTIFACT_RADIUS,
+    kernel_size: int = MASK_KERNEL_SIZE,
+    dilation: int = MASK_DILATION,
+) -> np.ndarray:
+    """
+    Returns a boolean array (True = edit) the size of base_image.
+    """
+    if brushed_image.size != base_image.size:
+        brushed_image = brushed_image.resize(base_image.size, Image.LANCZOS)
+
+    # uploads that already are black/white masks (of a base photo that isn't) are thresholded directly
+    grayscale = np.asarray(brushed_image.convert("L"))
+    if _binary_ratio(grayscale) >= BINARY_UPLOAD_RATIO > _binary_ratio(np.asarray(base_image.convert("L"))):
+        return grayscale > 127
+
+    base_image, brushed_image = base_image.convert("RGB"), brushed_image.convert("RGB")
+    if artifact_radius:
+        base_image = base_image.filter(ImageFilter.GaussianBlur(artifact_radius))
+        brushed_image = brushed_image.filter(ImageFilter.GaussianBlur(artifact_radius))
+    difference = np.asarray(base_image, dtype=np.int16) - np.asarray(brushed_image, dtype=np.int16)
+    # compare squared distances to avoid a sqrt per pixel
+    distance = np.einsum("ijk,ijk->ij", difference, difference, dtype=np.int32)
+    mask = distance > threshold * threshold
+
+    # opening then closing
+    mask = dilate(erode(mask, kernel_size), kernel_size)
+    mask = erode(dilate(mask, kernel_size), kernel_size)
+    if dilation:
+        mask = dilate(mask, 2 * dilation + 1)
+    return mask
+
+
+@run_in_threadpool_decorator("image_processing")
+def derive_mask_png(base_bytes: bytes, brushed_bytes: bytes) -> tuple:
+    """
+    Returns (1-bit PNG bytes, fraction of the image covered by the mask).
+    """
+    base_image = Image.open(io.BytesIO(base_bytes))
+    brushed_image = Image.open(io.BytesIO(brushed_bytes))
+    mask = compute_mask(base_image, brushed_image)
+
+    buffer = io.BytesIO()
+    Image.fromarray(mask.astype(np.uint8) * 255).convert("1").save(buffer, format="PNG", optimize=True)
+    coverage = float(mask.mean())
+    logger.debug(f"Derived mask {mask.shape[1]}x{mask.shape[0]}, coverage {coverage:.3f}, {buffer.tell()} bytes")
+    return buffer.getvalue(), coverage
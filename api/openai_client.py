@@ -0,0 +1,126 @@
+"""
+Native asyncio client for OpenAI's chat completions endpoint.
+
+A single httpx.AsyncClient (keep-alive connection pool, HTTP/2 when the h2 package is installed) is shared by
+every conversation, so concurrent ChatGPT calls no longer each need a thread and a fresh HTTPS handshake.
+stream() yields the reply token by token (server-sent events) for rendering partial results.
+httpx is imported when the connection pool is first opened rather than with this module.
+"""
+import json
+import logging
+from .services import get_config, startup_phase
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_BASE = config.get("OPENAI_API_BASE") or "https://api.openai.com/v1"
+OPENAI_POOL_SIZE = int(config.get("OPENAI_POOL_SIZE") or 20)
+OPENAI_CONNECT_TIMEOUT = float(config.get("OPENAI_CONNECT_TIMEOUT") or 10)
+OPENAI_READ_TIMEOUT = float(config.get("OPENAI_READ_TIMEOUT") or 120)
+OPENAI_HTTP2 = (config.get("OPENAI_HTTP2") or "true").lower() == "true"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class AsyncChatClient:
+    """
+    Wraps one shared httpx.AsyncClient for /chat/completions requests.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        api_base: str = OPENAI_API_BASE,
+        pool_size: int = OPENAI_POOL_SIZE,
+        connect_timeout: float = OPENAI_CONNECT_TIMEOUT,
+        read_timeout: float = OPENAI_READ_TIMEOUT,
+        http2: bool = OPENAI_HTTP2,
+    ) -> None:
+        self.api_key = api_key
+        self.api_base = api_base.rstrip("/")
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.http2 = http2 and _http2_available()
+        self._client = None
+
+    @property
+    def client(self) -> "httpx.AsyncClient":
+        # created lazily so that the connection pool binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            import httpx
+
+            self._client = httpx.AsyncClient(
+                base_url=self.api_base,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                http2=self.http2,
+                timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size,
+                ),
+            )
+            logger.info(
+                f"Started OpenAI connection pool (size={self.pool_size}, http2={self.http2})"
+            )
+        return self._client
+
+    async def create(self, messages: list, model: str, temperature: float, **kwargs) -> dict:
+        """
+        Sends a chat completion request and returns the decoded JSON response.
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature}
+        payload.update(kwargs)
+        response = await self.client.post("/chat/completions", json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    async def stream(self, messages: list, model: str, temperature: float, **kwargs):
+        """
+        Sends a streaming chat completion request and yields the content deltas as they arrive.
+        """
+        payload = {"model": model, "messages": messages, "temperature": temperature, "stream": True}
+        payload.update(kwargs)
+        async with self.client.stream("POST", "/chat/completions", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                if choices:
+                    delta = (choices[0].get("delta") or {}).get("content")
+                    if delta:
+                        yield delta
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+# process-wide client shared by every conversation
+_chat_client = None
+
+
+def get_chat_client() -> AsyncChatClient:
+    global _chat_client
+    if _chat_client is None:
+        with startup_phase("openai client"):
+            _chat_client = AsyncChatClient(api_key=config["OPENAI_API_KEY"])
+    return _chat_client
+
+
+async def close_chat_client() -> None:
+    if _chat_client is not None:
+        await _chat_client.aclose()
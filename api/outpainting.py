@@ -5,15 +5,14 @@
 ## The conversation handler then continues and prompts the user for a second image, again to be stored in s3.
 ## The conversation handler then calls the outpainting function, which is left to be defined for now.
 
-import openai
 import logging
-from dotenv import dotenv_values
-import json
-import boto3
+from .services import get_config, services
 import unicodedata
 from datetime import datetime
-import io
 from .utils import run_in_threadpool_decorator
+from .log_setup import log_update
+from .jobs import EditJobMessage, encode_job
+from .preprocessing import download_photo
 
 from telegram import __version__ as TG_VER
 from telegram.ext import (
@@ -42,16 +41,9 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
     )
 
 # get config
-config = dotenv_values(".env")
-# get API tokens
-HF_TOKEN = config["HF_API_KEY"]
-openai.api_key = config["OPENAI_API_KEY"]
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(processName)s - %(threadName)s - [%(thread)d] - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+config = get_config()
+
+# get logger (handlers and levels are set up by the bot with configure_logging)
 logger = logging.getLogger(__name__)
 
 
@@ -103,39 +95,44 @@ async def outpainting_process_terminate(update: Update, context: ContextTypes):
 
 class ImageProcessor:
     def __init__(self) -> None:
-        # Start s3 and sns clients
-        self.s3_client = boto3.client("s3")
-        self.sqs_client = boto3.client("sqs", region_name="ap-southeast-1")
-        self.QueueUrl = QUEUE_URL = config["SQS_URL"]
+        # s3 uploads and sqs messages go through the shared storage layer and job submitter, created on first use
         # self.base_image_s3_key = None
         # self.mask_image_s3_key = None
-
-        self.bucket_name = BUCKET_NAME = config["BUCKET_NAME"]
         self.state = None
 
-    @run_in_threadpool_decorator(name="aws_io")
-    def upload_to_s3(self, file_stream, BUCKET_NAME, s3_key):
-        response = self.s3_client.upload_fileobj(file_stream, self.bucket_name, s3_key)
-        logger.log(logging.INFO, f"response: {response}")
-        return 0
-
-    @run_in_threadpool_decorator(name="aws_io")
-    def put_to_sqs(self, MessageBody):
-        MessageBody = json.dumps(MessageBody)
-
-        response = self.sqs_client.send_message(
-            QueueUrl=self.QueueUrl, MessageBody=MessageBody
+    @property
+    def storage(self):
+        return services.storage
+
+    @property
+    def job_submitter(self):
+        return services.job_submitter
+
+    @property
+    def job_status(self):
+        return services.job_status
+
+    async def put_to_sqs(self, job: EditJobMessage):
+        MessageBody = encode_job(job)
+
+        # recorded before submitting so the worker always finds the job when it starts it
+        await self.job_status.record_queued(job)
+        # coalesced with other jobs into a SendMessageBatch call, returns once SQS acknowledged this message
+        try:
+            message_id = await self.job_submitter.submit(MessageBody)
+        except Exception as e:
+            await self.job_status.mark_failed(job.trace_id, f"submit failed: {e}")
+            raise
+        logger.log(
+            logging.INFO,
+            f"trace_id:{job.trace_id} message_id:{message_id} size:{len(MessageBody)}",
         )
-        logger.log(logging.INFO, f"response:{response}")
         return 0
 
     async def outpainting_process_image(self, update: Update, context: ContextTypes):
         # self.state = ConversationHandler.END
 
-        update_as_dict = update.to_dict()
-        update_as_json = json.dumps(update_as_dict)
-
-        logger.log(logging.INFO, f"update_as_json: {update_as_json}")
+        log_update(logger, update, "outpainting_image", state=PROCESS_IMAGE)
 
         if (
             update.message.chat.username is None
@@ -149,32 +146,34 @@ class ImageProcessor:
 
         if (
             update.message.photo
-        ):  # User uploaded an image. Put the image into s3 bucket.Put update_as_json to SQS queue
-            # Initialize timestamp for uniqueness and file stream buffer
+        ):  # User uploaded an image. Put the image into s3 bucket.Put the job message to SQS queue
+            # Initialize timestamp for uniqueness
             timestamp_str = datetime.now().strftime("%Y%m%d%H%M%S")
-            file_stream = io.BytesIO()
 
             # Get file name and file id from telegram update
             file_id = update.message.photo[-1].file_id
             file_name = f"{file_id}{timestamp_str}.jpg"
-            file = await update.message.photo[-1].get_file()
-
-            # Download file to file stream buffer
-            await file.download_to_memory(out=file_stream)
-            file_stream.seek(0)  # Reset file stream buffer pointer to start of buffer
+            # Download the smallest size covering the model's working resolution, fix its orientation and downscale it
+            image_bytes, image_size = await download_photo(update.message.photo)
 
             s3_key = f"input/outpaint-image/{clean_username}/{file_name}"
-            await self.upload_to_s3(file_stream, self.bucket_name, s3_key)
+            await self.storage.upload_bytes(s3_key, image_bytes)
             # self.mask_image_s3_key = s3_key
             context.user_data["editing_image_job"]["base_image_s3_key"] = s3_key
 
             try:
-                MessageBody = update_as_dict
-                MessageBody["editing_image_job"] = context.user_data[
-                    "editing_image_job"
-                ]
+                # only the fields the worker needs are sent, not the whole update
+                editing_job = context.user_data["editing_image_job"]
+                job = EditJobMessage(
+                    job_type=editing_job["job_type"],
+                    chat_id=update.effective_chat.id,
+                    user_id=update.effective_user.id,
+                    base_image_s3_key=editing_job["base_image_s3_key"],
+                    direction=editing_job["outpaint_direction"],
+                    caption=update.message.caption,
+                )
 
-                await self.put_to_sqs(MessageBody)
+                await self.put_to_sqs(job)
 
                 await update.message.reply_text(
                     "Your image has been received!🙂 Your request is currently being processed, the image will be sent to you once it is completed.\n\nThis conversation has ended. Please send /outpainting to process a new image or send /start for a new conversation."
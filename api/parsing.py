@@ -0,0 +1,226 @@
+"""
+Safe parsing of ChatGPT's structured (JSON/dict literal) responses, replacing eval().
+
+parse_response() extracts the first {...} literal from the model output, tolerates single quotes, trailing commas,
+bare numeric keys and Python/JSON literal mix-ups, then validates the result against the schema of the step
+('themes', 'designs' or 'prompt'). Successes, repairs and failures are counted per step.
+"""
+import ast
+import json
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# attributes every image design must provide
+DESIGN_ATTRIBUTES = ("image description", "style of visual image", "object in foreground description")
+
+
+class ResponseParseError(ValueError):
+    """Raised when a model response cannot be parsed or does not match the expected schema."""
+
+    def __init__(self, step: str, message: str) -> None:
+        super().__init__(f"[{step}] {message}")
+        self.step = step
+
+
+# find the outermost {...} literal, skipping braces inside quoted strings
+def extract_literal(text: str) -> str:
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("no '{' found in response")
+
+    depth = 0
+    quote = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start : index + 1]
+    # quote tracking was thrown off (e.g. an unescaped apostrophe), fall back to the last closing brace
+    end = text.rfind("}")
+    if end > start:
+        return text[start : end + 1]
+    # most likely a truncated response: close the open braces and let the parsers decide
+    return text[start:] + "}" * depth
+
+
+def _repair_json(literal: str) -> str:
+    literal = literal.replace("“", '"').replace("”", '"').replace("’", "'")
+    literal = re.sub(r",\s*([}\]])", r"\1", literal)  # trailing commas
+    literal = re.sub(r"([{,]\s*)(\d+)\s*:", r'\1"\2":', literal)  # bare numeric keys
+    return literal
+
+
+def _repair_python(literal: str) -> str:
+    literal = literal.replace("“", '"').replace("”", '"')
+    literal = re.sub(r"\btrue\b", "True", literal)
+    literal = re.sub(r"\bfalse\b", "False", literal)
+    literal = re.sub(r"\bnull\b", "None", literal)
+    literal = re.sub(r"(?<=[A-Za-z])(?<!\\)'(?=[A-Za-z])", r"\\'", literal)  # unescaped apostrophes, e.g. house's
+    return literal
+
+
+def parse_literal(text: str) -> tuple:
+    """
+    Returns (parsed object, repaired) where repaired is True when the literal needed fixing before it parsed.
+    """
+    literal = extract_literal(text)
+    attempts = (
+        (False, json.loads, literal),
+        (False, ast.literal_eval, literal),
+        (True, json.loads, _repair_json(literal)),
+        (True, ast.literal_eval, _repair_python(literal)),
+    )
+    errors = []
+    for repaired, parser, candidate in attempts:
+        try:
+            return parser(candidate), repaired
+        except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+            errors.append(f"{parser.__name__}: {e}")
+    raise ValueError("; ".join(errors))
+
+
+# schema of each conversation step, each validator returns the normalized result
+def validate_themes(obj) -> dict:
+    if not isinstance(obj, dict) or not obj:
+        raise ValueError("themes must be a non-empty object")
+    themes = {}
+    for index, theme in enumerate(obj.values(), start=1):
+        if not isinstance(theme, str) or not theme.strip():
+            raise ValueError(f"theme {index} is not a string")
+        themes[index] = theme.strip()
+    return themes
+
+
+def validate_designs(obj) -> dict:
+    if not isinstance(obj, dict) or not obj:
+        raise ValueError("image designs must be a non-empty object")
+    designs = {}
+    for index, design in enumerate(obj.values(), start=1):
+        if not isinstance(design, dict):
+            raise ValueError(f"image design {index} is not an object")
+        missing = [attribute for attribute in DESIGN_ATTRIBUTES if attribute not in design]
+        if missing:
+            raise ValueError(f"image design {index} is missing {missing}")
+        # the optional text-to-image prompt (DESIGN_PROMPTS_ENABLED) is dropped when unusable, it is generated later
+        if "prompt" in design and (not isinstance(design["prompt"], str) or not design["prompt"].strip()):
+            design = {attribute: value for attribute, value in design.items() if attribute != "prompt"}
+        designs[f"output_{index}"] = design
+    return designs
+
+
+def validate_prompt(obj) -> dict:
+    if not isinstance(obj, dict) or not isinstance(obj.get("prompt"), str) or not obj["prompt"].strip():
+        raise ValueError("response has no 'prompt' string")
+    return obj
+
+
+SCHEMAS = {
+    "themes": validate_themes,
+    "designs": validate_designs,
+    "prompt": validate_prompt,
+}
+
+
+# counters of parse outcomes per step
+_parse_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_parse_event(step: str, event: str) -> None:
+    with _stats_lock:
+        step_stats = _parse_stats.setdefault(
+            step, {"ok": 0, "repaired": 0, "failed": 0, "retries": 0}
+        )
+        step_stats[event] += 1
+
+
+def parse_stats() -> dict:
+    with _stats_lock:
+        return {step: dict(step_stats) for step, step_stats in _parse_stats.items()}
+
+
+def parse_response(text: str, step: str):
+    """
+    Parses and validates the model output of step, raising ResponseParseError when it cannot be used.
+    """
+    try:
+        obj, repaired = parse_literal(text)
+        result = SCHEMAS[step](obj)
+    except ValueError as e:
+        record_parse_event(step, "failed")
+        logger.warning(f"Failed to parse {step} response: {e}")
+        raise ResponseParseError(step, str(e)) from e
+    record_parse_event(step, "repaired" if repaired else "ok")
+    return result
+
+
+def parse_partial(text: str, step: str) -> dict:
+    """
+    Returns the complete top-level members of a response that is still being streamed, normalized like
+    parse_response() (e.g. the first 2 themes while the 3rd one is being written). Best effort, {} until one parses.
+    """
+    start = text.find("{")
+    if start == -1:
+        return {}
+    members_end = None
+    depth = 0
+    quote = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                members_end = index
+                break
+        elif char == "," and depth == 1:
+            members_end = index
+    if members_end is None:
+        return {}
+    try:
+        obj, _ = parse_literal(text[start:members_end] + "}")
+        return SCHEMAS[step](obj)
+    except ValueError:
+        return {}
+
+
+def build_repair_messages(prompt: str, response: str, error: Exception) -> list:
+    """
+    Chat messages asking the model to resend its previous answer as a valid literal.
+    """
+    return [
+        {"role": "user", "content": prompt},
+        {"role": "assistant", "content": response},
+        {
+            "role": "user",
+            "content": f"Your previous reply could not be parsed ({error}). "
+            "Reply again with only the corrected JSON object in the requested format and no other text.",
+        },
+    ]
@@ -0,0 +1,272 @@
+"""
+SQLite (WAL mode) persistence for the telegram Application, replacing PicklePersistence.
+
+- user_data/chat_data are loaded lazily, one row per user/chat, the first time an update for them is processed
+- only users/chats/conversations whose pickled data actually changed are written
+- writes are coalesced over write_delay seconds and committed in one transaction on the disk_io thread pool
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import pickle
+import sqlite3
+import threading
+from telegram.ext import BasePersistence, PersistenceInput
+from .utils import run_in_threadpool_decorator
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (user_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS chat_data (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS kv_data (name TEXT PRIMARY KEY, data BLOB NOT NULL);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    key TEXT NOT NULL,
+    state BLOB NOT NULL,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Incremental, write-coalescing persistence backed by a single SQLite database file.
+
+    Args:
+        filepath (str): path of the SQLite database
+        store_data (PersistenceInput): which kinds of data to persist, defaults to all
+        update_interval (float): seconds between the Application's persistence updates
+        write_delay (float): seconds that changes are buffered before being written in one transaction
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        store_data: PersistenceInput = None,
+        update_interval: float = 60,
+        write_delay: float = 1.0,
+    ) -> None:
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.filepath = filepath
+        self.write_delay = write_delay
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        # ids whose rows have been loaded into the Application's dictionaries
+        self._loaded_users = set()
+        self._loaded_chats = set()
+        # digest of the last written pickle per row, to skip unchanged data
+        self._digests = {}
+        # pending writes: (table, key) -> pickled bytes, or None to delete the row
+        self._pending = {}
+        self._write_task = None
+        self.rows_written = 0
+        self.writes_skipped = 0
+
+    # ---------- helpers ----------
+    def _select(self, sql: str, params: tuple = ()) -> list:
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @run_in_threadpool_decorator("disk_io")
+    def _aselect(self, sql: str, params: tuple = ()) -> list:
+        return self._select(sql, params)
+
+    async def _load_row(self, table: str, id_column: str, row_id: int):
+        rows = await self._aselect(f"SELECT data FROM {table} WHERE {id_column} = ?", (row_id,))
+        if not rows:
+            return None
+        self._digests[(table, row_id)] = hashlib.sha1(rows[0][0]).digest()
+        return pickle.loads(rows[0][0])
+
+    def _stage(self, table: str, key, data) -> None:
+        """
+        Buffers the new value of a row if it differs from what was last written, then schedules a write.
+        """
+        if data is None:
+            self._digests.pop((table, key), None)
+            self._pending[(table, key)] = None
+        else:
+            blob = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+            digest = hashlib.sha1(blob).digest()
+            if self._digests.get((table, key)) == digest:
+                self.writes_skipped += 1
+                return
+            self._digests[(table, key)] = digest
+            self._pending[(table, key)] = blob
+        self._schedule_write()
+
+    def _schedule_write(self) -> None:
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.get_running_loop().create_task(self._delayed_write())
+
+    async def _delayed_write(self) -> None:
+        await asyncio.sleep(self.write_delay)
+        await self._write_pending()
+
+    async def _write_pending(self) -> None:
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        await self._write_rows(pending)
+
+    @run_in_threadpool_decorator("disk_io")
+    def _write_rows(self, pending: dict) -> None:
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            try:
+                for (table, key), blob in pending.items():
+                    if table == "conversations":
+                        name, conversation_key = key
+                        if blob is None:
+                            self._conn.execute(
+                                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                                (name, conversation_key),
+                            )
+                        else:
+                            self._conn.execute(
+                                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                                (name, conversation_key, blob),
+                            )
+                    else:
+                        id_column = {"user_data": "user_id", "chat_data": "chat_id", "kv_data": "name"}[table]
+                        if blob is None:
+                            self._conn.execute(f"DELETE FROM {table} WHERE {id_column} = ?", (key,))
+                        else:
+                            self._conn.execute(
+                                f"INSERT OR REPLACE INTO {table} ({id_column}, data) VALUES (?, ?)",
+                                (key, blob),
+                            )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self.rows_written += len(pending)
+
+    # ---------- loading ----------
+    async def get_user_data(self) -> dict:
+        # loaded per user in refresh_user_data
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        # loaded per chat in refresh_chat_data
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        rows = await self._aselect("SELECT data FROM kv_data WHERE name = 'bot_data'")
+        return pickle.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self):
+        rows = await self._aselect("SELECT data FROM kv_data WHERE name = 'callback_data'")
+        return pickle.loads(rows[0][0]) if rows else None
+
+    async def get_conversations(self, name: str) -> dict:
+        rows = await self._aselect("SELECT key, state FROM conversations WHERE name = ?", (name,))
+        conversations = {}
+        for key, state in rows:
+            conversations[tuple(json.loads(key))] = pickle.loads(state)
+            self._digests[("conversations", (name, key))] = hashlib.sha1(state).digest()
+        return conversations
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        stored_data = await self._load_row("user_data", "user_id", user_id)
+        if stored_data:
+            # keep anything written to user_data while the row was being read
+            user_data.update({**stored_data, **user_data})
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        if chat_id in self._loaded_chats:
+            return
+        self._loaded_chats.add(chat_id)
+        stored_data = await self._load_row("chat_data", "chat_id", chat_id)
+        if stored_data:
+            chat_data.update({**stored_data, **chat_data})
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        # bot_data is fully loaded at startup
+        pass
+
+    # ---------- updating ----------
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._stage("user_data", user_id, data)
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        self._stage("chat_data", chat_id, data)
+
+    async def update_bot_data(self, data: dict) -> None:
+        self._stage("kv_data", "bot_data", data)
+
+    async def update_callback_data(self, data) -> None:
+        self._stage("kv_data", "callback_data", data)
+
+    async def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        self._stage("conversations", (name, json.dumps(list(key))), new_state)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._loaded_users.discard(user_id)
+        self._stage("user_data", user_id, None)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._loaded_chats.discard(chat_id)
+        self._stage("chat_data", chat_id, None)
+
+    async def flush(self) -> None:
+        if self._write_task is not None and not self._write_task.done():
+            self._write_task.cancel()
+        await self._write_pending()
+        with self._db_lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        logger.info(
+            f"Flushed persistence to {self.filepath} (rows written={self.rows_written}, unchanged skipped={self.writes_skipped})"
+        )
+
+    def stats(self) -> dict:
+        return {
+            "loaded_users": len(self._loaded_users),
+            "loaded_chats": len(self._loaded_chats),
+            "pending_rows": len(self._pending),
+            "rows_written": self.rows_written,
+            "writes_skipped": self.writes_skipped,
+        }
+
+    # ---------- migration ----------
+    def import_pickle_file(self, filepath: str) -> None:
+        """
+        One-off import of a single-file PicklePersistence (e.g. data/conversation) into the database.
+        """
+        with open(filepath, "rb") as f:
+            data = pickle.load(f)
+
+        with self._db_lock:
+            self._conn.execute("BEGIN")
+            for user_id, user_data in (data.get("user_data") or {}).items():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                    (user_id, pickle.dumps(user_data, protocol=pickle.HIGHEST_PROTOCOL)),
+                )
+            for chat_id, chat_data in (data.get("chat_data") or {}).items():
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chat_data (chat_id, data) VALUES (?, ?)",
+                    (chat_id, pickle.dumps(chat_data, protocol=pickle.HIGHEST_PROTOCOL)),
+                )
+            if data.get("bot_data"):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO kv_data (name, data) VALUES ('bot_data', ?)",
+                    (pickle.dumps(data["bot_data"], protocol=pickle.HIGHEST_PROTOCOL),),
+                )
+            for name, conversations in (data.get("conversations") or {}).items():
+                for key, state in conversations.items():
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                        (name, json.dumps(list(key)), pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)),
+                    )
+            self._conn.execute("COMMIT")
+        logger.info(f"Imported PicklePersistence file {filepath} into {self.filepath}")
@@ -0,0 +1,85 @@
+"""
+Preprocessing of photos uploaded for image-editing jobs before they are stored in S3.
+
+Telegram offers each photo in several sizes; the smallest one covering the editing model's working resolution
+(EDIT_WORKING_RESOLUTION) is downloaded, rotated according to its EXIF orientation, downscaled and re-encoded as
+JPEG (UPLOAD_JPEG_QUALITY). Inpainting masks are resized to the exact dimensions of their base image so the
+worker can diff them pixel by pixel. Pillow work runs on the image_processing thread pool.
+"""
+import io
+import logging
+from .services import get_config
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# longest side (px) of images handed to the editing model
+EDIT_WORKING_RESOLUTION = int(config.get("EDIT_WORKING_RESOLUTION") or 1024)
+UPLOAD_JPEG_QUALITY = int(config.get("UPLOAD_JPEG_QUALITY") or 90)
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def select_photo_size(photo_sizes, min_side: int = EDIT_WORKING_RESOLUTION):
+    """
+    Returns the smallest telegram PhotoSize whose longest side covers min_side, or the largest one available.
+    """
+    for photo_size in sorted(photo_sizes, key=lambda p: p.width * p.height):
+        if max(photo_size.width, photo_size.height) >= min_side:
+            return photo_size
+    return max(photo_sizes, key=lambda p: p.width * p.height)
+
+
+@run_in_threadpool_decorator("image_processing")
+def preprocess_image(
+    data: bytes,
+    max_side: int = EDIT_WORKING_RESOLUTION,
+    quality: int = UPLOAD_JPEG_QUALITY,
+    size: tuple = None,
+) -> tuple:
+    """
+    Normalizes orientation, downscales to max_side (or resizes to exactly size) and re-encodes as JPEG.
+
+    Returns (jpeg bytes, (width, height)). JPEG uploads that need no change are returned as is.
+    """
+    from PIL import Image, ImageOps
+
+    image = Image.open(io.BytesIO(data))
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    target_size = tuple(size) if size else None
+    if (
+        image.format == "JPEG"
+        and orientation == 1
+        and (image.size == target_size if target_size else max(image.size) <= max_side)
+    ):
+        return data, image.size
+
+    # let the JPEG decoder downscale by a power of two while decoding, the result still covers the target
+    draft_side = max(target_size) if target_size else max_side
+    if image.format == "JPEG":
+        image.draft("RGB", (draft_side, draft_side))
+
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    if target_size:
+        if image.size != target_size:
+            image = image.resize(target_size, Image.LANCZOS)
+    elif max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    logger.debug(f"Preprocessed upload {len(data)} -> {buffer.tell()} bytes, {image.size}")
+    return buffer.getvalue(), image.size
+
+
+async def download_photo(photo_sizes, size: tuple = None) -> tuple:
+    """
+    Downloads the best-fitting size of a telegram photo and preprocesses it, see preprocess_image().
+    """
+    min_side = max(size) if size else EDIT_WORKING_RESOLUTION
+    file = await select_photo_size(photo_sizes, min_side).get_file()
+    data = bytes(await file.download_as_bytearray())
+    return await preprocess_image(data, size=size)
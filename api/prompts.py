@@ -0,0 +1,191 @@
+"""
+Prompt compiler for the text-to-image prompt step (generate_prompt_and_image).
+
+The instruction template is assembled once at import. For each request only a few sample image descriptions are
+included: those tagged with the requested image type, ranked by word overlap with the design attributes, within
+the step's input token budget (PROMPT_TOKEN_BUDGET_<STEP>). Token counts are estimated locally (tiktoken when
+installed, ~4 characters per token otherwise), and the input/output tokens of each call are recorded per step.
+
+With DESIGN_PROMPTS_ENABLED the design step asks for the finished text-to-image prompt of each proposed design in
+the same response (see design_prompt_instructions), so selecting a listed design needs no further ChatGPT call.
+"""
+import logging
+import re
+import threading
+from .services import get_config
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# number of sample image descriptions shown to the model
+PROMPT_SAMPLES = int(config.get("PROMPT_SAMPLES") or 3)
+
+# ask for the text-to-image prompt of every proposed image design in the design step itself
+DESIGN_PROMPTS_ENABLED = (config.get("DESIGN_PROMPTS_ENABLED") or "false").lower() == "true"
+# number of sample image descriptions shown in the design step
+DESIGN_PROMPT_SAMPLES = 2
+
+# input token budget of each step's prompt
+PROMPT_TOKEN_BUDGETS = {
+    step: int(config.get(f"PROMPT_TOKEN_BUDGET_{step.upper()}") or default)
+    for step, default in (("themes", 600), ("designs", 700), ("prompt", 600))
+}
+
+# sample image descriptions and the image types they suit ('image' is used for custom prompts)
+SAMPLE_PROMPTS = [
+    ('A still life of flowers, in the style of Jan van Huysum’s paintings, with a lush arrangement of blooms in a vase, surrounded by delicate butterflies, bees, and other insects.',
+     ('illustration', 'poster', 'image')),
+    ('A digital collage of iconic tech gadgets, such as the iPhone, MacBook, and Amazon Echo, in the style of David Hockney.',
+     ('poster', 'illustration', 'image')),
+    ('A surreal underwater world in the style of Salvador Dali, where all the sea creatures are actually different tech gadgets like iPhones, laptops, and smartwatches, floating amongst the seaweed and coral.',
+     ('illustration', 'image')),
+    ('A space station in the style of Stanley Kubrick’s 2001: A Space Odyssey, where all the spaceships and equipment are made of different popular candy bars like Snickers, Milky Way, and Three Musketeers, and all the astronauts are dressed as characters from Star Trek.',
+     ('illustration', 'poster', 'image')),
+    ('A retro pop art-style illustration of the famous Hollywood sign, surrounded by colorful and iconic classic cars like the Corvette and the Mustang.',
+     ('poster', 'illustration', 'image')),
+    ('A surreal, abstract landscape, inspired by Joan Miró’s paintings, with strange shapes, lines, and colors arranged in an imaginary world, with floating objects like planets and stars.',
+     ('poster', 'illustration', 'image')),
+    ('main model shoot style, 8k 3d render sharp focus photography low angle shot high detail, beautiful Chinese fantasy woman portrait, teenage 23 years old, Looking at camera, fierce gaze, black lace textures, Michael parkes art, fantasy concept, 1379 Chiba imperial dynasty concubine. mythology, sleeveless gothic black gown, holding a dragon, red lips stained dripping honey, floral flower organic textures. realistic object octane Renders, outdoor lowlight moonlight dark dirty forest, dynamic lighting full length portrait, octane volumetric lighting, edge lighting, octane render, 8k, perfect shading, trending on artstation, ultra-realistic, concept art, Dark Mode, Tones of Black in Background, Spotlight, Beautiful cinematic shot + photos taken by ARRI, photos taken by sony, photos taken by canon, photos taken by nikon, photos taken by sony, photos taken by hasselblad + incredibly detailed, sharpen, details + professional lighting, photography lighting + 50mm, 80mm, 100m + lightroom gallery + behance photographys + unsplash –ar 2:3',
+     ('realistic photo',)),
+    ('The Battle of Agincourt, 1415 - A bird’s eye view of the Battle of Agincourt, with English and French soldiers clashing on the battlefield and arrows raining down from the sky. In the style of Peter Paul Rubens’ Baroque battle scenes.',
+     ('illustration', 'image')),
+    ('A steampunk-inspired train station, where all the trains are made of different popular soda brands like Coca-Cola, Pepsi, and Dr. Pepper, and the passengers are robots and cyborgs.',
+     ('poster', 'illustration', 'image')),
+    ('A spooky graveyard in the style of Edward Gorey, where all the tombstones and monuments are made of different popular cookies like Oreos, Chips Ahoy, and Nutter Butters, and all the ghosts are dressed as characters from The Addams Family.',
+     ('illustration', 'image')),
+    ('Create a photojournalistic-style image of Winston Smith as he starts to rebel against the oppressive government in George Orwell’s “1984.” Show him standing in front of a “Big Brother” poster, with a determined look on his face and the cityscape of Airstrip One in the background.',
+     ('realistic photo', 'poster', 'image')),
+    ('Using a minimalist, sketch-like style, create an image of Holden Caulfield sitting on a bench in Central Park, New York, deep in thought as he contemplates the world around him. Show his melancholic expression and the cityscape behind him, with a backdrop of the wintry New York sky.',
+     ('illustration', 'realistic photo', 'image')),
+    ('Using a whimsical, fantasy-style illustration, create an image of Alice in Wonderland falling down the rabbit hole. Show her surrounded by fantastical creatures, with the White Rabbit peeking out from behind a tree and a sense of wonder and adventure in the air.',
+     ('illustration', 'poster', 'image')),
+]
+
+IMAGE_PROMPT_TEMPLATE = r'''
+You are a digital marketing AI assistant for {company} in Singapore.
+Describe an image with the design attributes delimited by ``` as one text-to-image prompt,
+following the sentence structure and level of detail of the sample image descriptions delimited by ```.
+Use '\'s' for any word that requires ```'s```, example: the house\'s window.
+Return only JSON: {{'prompt': image description}}
+design attributes: ```{design_attributes}```
+sample image descriptions: ```{sample_prompts}```
+'''
+
+DESIGN_PROMPT_INSTRUCTIONS = r'''
+Also add a 'prompt' attribute to each output: the design described as one text-to-image prompt of a {image_type}
+in 8k resolution, following the sentence structure and level of detail of the sample image descriptions delimited by ```.
+sample image descriptions: ```{sample_prompts}```'''
+
+_WORD = re.compile(r"[a-z]+")
+
+if tiktoken is not None:
+    _encoding = tiktoken.get_encoding("cl100k_base")
+else:
+    _encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Returns the number of tokens of text for the chat models (approximate without tiktoken).
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def _words(text: str) -> set:
+    return set(_WORD.findall(text.lower()))
+
+
+# built once: token counts and vocabulary of every sample
+_SAMPLES = [
+    {"text": text, "types": set(image_types), "tokens": estimate_tokens(repr(text)), "words": _words(text)}
+    for text, image_types in SAMPLE_PROMPTS
+]
+_TEMPLATE_TOKENS = estimate_tokens(IMAGE_PROMPT_TEMPLATE)
+_DESIGN_INSTRUCTIONS_TOKENS = estimate_tokens(DESIGN_PROMPT_INSTRUCTIONS)
+
+
+def select_samples(image_type: str, design_attributes: dict, token_budget: int, count: int = PROMPT_SAMPLES) -> list:
+    """
+    Returns up to count sample descriptions suiting image_type, most relevant first, within token_budget.
+    """
+    attribute_words = _words(" ".join(str(value) for value in design_attributes.values()))
+    candidates = [sample for sample in _SAMPLES if image_type in sample["types"]] or _SAMPLES
+    candidates = sorted(candidates, key=lambda sample: -len(sample["words"] & attribute_words))
+    selected, tokens = [], 0
+    for sample in candidates:
+        if len(selected) == count:
+            break
+        if tokens + sample["tokens"] > token_budget:
+            continue
+        selected.append(sample["text"])
+        tokens += sample["tokens"]
+    return selected
+
+
+def build_image_prompt(company: str, image_type: str, design_attributes: dict) -> str:
+    """
+    Returns the ChatGPT prompt for the text-to-image prompt of a selected image design.
+    """
+    budget = PROMPT_TOKEN_BUDGETS["prompt"]
+    fixed_tokens = _TEMPLATE_TOKENS + estimate_tokens(company) + estimate_tokens(str(design_attributes))
+    samples = select_samples(image_type, design_attributes, budget - fixed_tokens)
+    prompt = IMAGE_PROMPT_TEMPLATE.format(
+        company=company, design_attributes=design_attributes, sample_prompts=samples
+    )
+    if not samples:
+        logger.warning(f"No sample image description fits the prompt token budget ({budget})")
+    return prompt
+
+
+def design_prompt_instructions(design_prompt: str, image_type: str, selected_theme: str) -> str:
+    """
+    Returns the instructions appended to design_prompt (the design step's prompt) asking for each design's
+    text-to-image prompt, with sample descriptions within the rest of the design step's token budget.
+    """
+    budget = PROMPT_TOKEN_BUDGETS["designs"]
+    fixed_tokens = estimate_tokens(design_prompt) + _DESIGN_INSTRUCTIONS_TOKENS
+    samples = select_samples(image_type, {"theme": selected_theme}, budget - fixed_tokens, DESIGN_PROMPT_SAMPLES)
+    if not samples:
+        logger.warning(f"No sample image description fits the design prompt token budget ({budget})")
+    return DESIGN_PROMPT_INSTRUCTIONS.format(image_type=image_type, sample_prompts=samples)
+
+
+# input/output token counts of completed calls per step
+_token_stats = {}
+_stats_lock = threading.Lock()
+
+
+def record_token_usage(step: str, input_tokens: int, output_tokens: int) -> None:
+    with _stats_lock:
+        step_stats = _token_stats.setdefault(step, {"calls": 0, "input_tokens": 0, "output_tokens": 0, "over_budget": 0})
+        step_stats["calls"] += 1
+        step_stats["input_tokens"] += input_tokens
+        step_stats["output_tokens"] += output_tokens
+        if step in PROMPT_TOKEN_BUDGETS and input_tokens > PROMPT_TOKEN_BUDGETS[step]:
+            step_stats["over_budget"] += 1
+    logger.info(f"{step} completion: input_tokens={input_tokens} output_tokens={output_tokens}")
+
+
+def token_stats() -> dict:
+    """
+    Returns the number of calls and average input/output tokens per step.
+    """
+    with _stats_lock:
+        return {
+            step: {
+                "calls": step_stats["calls"],
+                "avg_input_tokens": step_stats["input_tokens"] // step_stats["calls"],
+                "avg_output_tokens": step_stats["output_tokens"] // step_stats["calls"],
+                "over_budget": step_stats["over_budget"],
+            }
+            for step, step_stats in _token_stats.items()
+        }
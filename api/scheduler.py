@@ -0,0 +1,250 @@
+"""
+Admission control and fair scheduling of calls to the generation backends (HuggingFace txt2img, OpenAI chat).
+
+Every call first takes a slot of its backend's scheduler. A scheduler runs at most max_concurrent calls at once and
+at most per_user_limit calls of the same user; extra calls wait in line. Waiting calls are started in weighted fair
+order (start-time fair queuing): a user's call is tagged with max(virtual time, the user's last finish tag) and
+users with weight w advance by 1/w per call, so a user spamming requests only gets their fair share while others
+are waiting. Calls beyond max_backlog waiting calls (or max_user_backlog of one user) are rejected with
+SchedulerBusyError.
+
+Low-priority calls (speculative work) only start when no regular call is waiting for the slot, and are rejected
+right away when any call is already waiting. promote(task) turns the low-priority calls of a task into regular ones,
+e.g. once the user asks for the result of the speculative work.
+
+Weights default to 1 and can be set per telegram user id with SCHEDULER_USER_WEIGHTS="12345:2,67890:3".
+"""
+import asyncio
+import contextlib
+import itertools
+import logging
+import time
+import weakref
+from .services import get_config
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+# default sizing of each scheduler, overridden with <NAME>_MAX_CONCURRENT, <NAME>_MAX_CONCURRENT_PER_USER,
+# <NAME>_MAX_BACKLOG and <NAME>_MAX_USER_BACKLOG in .env (e.g. IMAGE_MAX_CONCURRENT=8)
+SCHEDULER_DEFAULTS = {
+    "image": {"max_concurrent": 8, "per_user_limit": 2, "max_backlog": 50, "max_user_backlog": 10},
+    "completion": {"max_concurrent": 16, "per_user_limit": 2, "max_backlog": 100, "max_user_backlog": 10},
+}
+
+
+def _parse_weights(value: str) -> dict:
+    weights = {}
+    for item in (value or "").split(","):
+        user_id, _, weight = item.strip().partition(":")
+        if user_id and weight:
+            try:
+                weights[int(user_id)] = float(weight)
+            except ValueError:
+                logger.warning(f"Ignoring invalid scheduler weight {item!r}")
+    return weights
+
+
+SCHEDULER_USER_WEIGHTS = _parse_weights(config.get("SCHEDULER_USER_WEIGHTS"))
+
+
+class SchedulerBusyError(RuntimeError):
+    """Raised when a scheduler already has too many calls waiting, in total or of the same user."""
+
+
+class _Request:
+    __slots__ = ("user_id", "start_tag", "sequence", "low_priority", "future", "granted", "enqueued_at", "task")
+
+    def __init__(self, user_id, start_tag: float, sequence: int, low_priority: bool = False) -> None:
+        self.user_id = user_id
+        self.task = asyncio.current_task()
+        self.low_priority = low_priority
+        self.start_tag = start_tag
+        self.sequence = sequence
+        self.future = asyncio.get_running_loop().create_future()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+    def order(self) -> tuple:
+        return (self.low_priority, self.start_tag, self.sequence)
+
+
+class FairScheduler:
+    def __init__(
+        self,
+        name: str,
+        max_concurrent: int,
+        per_user_limit: int,
+        max_backlog: int,
+        max_user_backlog: int,
+        weights: dict = None,
+    ) -> None:
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.per_user_limit = per_user_limit
+        self.max_backlog = max_backlog
+        self.max_user_backlog = max_user_backlog
+        self.weights = weights or {}
+        self._waiting = []
+        self._user_active = {}
+        self._user_waiting = {}
+        # user id -> finish tag of the user's last call
+        self._finish_tags = {}
+        self._virtual_time = 0.0
+        # tasks whose low-priority calls are treated as regular ones
+        self._promoted = weakref.WeakSet()
+        self._sequence = itertools.count()
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self._total_wait = 0.0
+        self._granted = 0
+
+    def _weight(self, user_id) -> float:
+        return self.weights.get(user_id, 1.0)
+
+    def _enqueue(self, user_id, low_priority: bool = False) -> _Request:
+        if low_priority and asyncio.current_task() in self._promoted:
+            low_priority = False
+        if (
+            len(self._waiting) >= (1 if low_priority else self.max_backlog)
+            or self._user_waiting.get(user_id, 0) >= self.max_user_backlog
+        ):
+            self.rejected += 1
+            raise SchedulerBusyError(f"{self.name} scheduler backlog is full")
+        start_tag = self._start_tag(user_id, low_priority)
+        request = _Request(user_id, start_tag, next(self._sequence), low_priority)
+        self._waiting.append(request)
+        self._user_waiting[user_id] = self._user_waiting.get(user_id, 0) + 1
+        return request
+
+    def _start_tag(self, user_id, low_priority: bool) -> float:
+        start_tag = max(self._virtual_time, self._finish_tags.get(user_id, 0.0))
+        if not low_priority:
+            # speculative work does not count against the user's fair share
+            self._finish_tags[user_id] = start_tag + 1.0 / self._weight(user_id)
+        return start_tag
+
+    def _remove_waiting(self, request: _Request) -> None:
+        self._waiting.remove(request)
+        self._user_waiting[request.user_id] -= 1
+        if not self._user_waiting[request.user_id]:
+            del self._user_waiting[request.user_id]
+
+    def _dispatch(self) -> None:
+        # start the waiting calls with the lowest start tags among users below their limit, regular calls first
+        while self.active < self.max_concurrent:
+            # a cancelled call leaves the line once its task runs again
+            eligible = [
+                request
+                for request in self._waiting
+                if not request.future.done() and self._user_active.get(request.user_id, 0) < self.per_user_limit
+            ]
+            if not eligible:
+                break
+            request = min(eligible, key=_Request.order)
+            self._remove_waiting(request)
+            self.active += 1
+            self._user_active[request.user_id] = self._user_active.get(request.user_id, 0) + 1
+            self._virtual_time = max(self._virtual_time, request.start_tag)
+            self._total_wait += time.monotonic() - request.enqueued_at
+            self._granted += 1
+            request.granted = True
+            request.future.set_result(None)
+
+    def _release(self, request: _Request) -> None:
+        self.active -= 1
+        self.completed += 1
+        self._user_active[request.user_id] -= 1
+        if not self._user_active[request.user_id]:
+            del self._user_active[request.user_id]
+        self._forget_if_idle(request.user_id)
+        self._dispatch()
+
+    def _forget_if_idle(self, user_id) -> None:
+        # idle users start again from the current virtual time
+        if user_id not in self._user_active and user_id not in self._user_waiting:
+            self._finish_tags.pop(user_id, None)
+
+    def promote(self, task: asyncio.Task) -> None:
+        """
+        Treats the low-priority calls of task as regular ones, the waiting one (if any) and those it makes later.
+        """
+        self._promoted.add(task)
+        for request in self._waiting:
+            if request.task is task and request.low_priority:
+                request.low_priority = False
+                request.start_tag = self._start_tag(request.user_id, False)
+        self._dispatch()
+
+    def position(self, request: _Request) -> int:
+        """
+        Returns the 1-based place of a waiting call in line.
+        """
+        return 1 + sum(1 for other in self._waiting if other.order() < request.order())
+
+    @contextlib.asynccontextmanager
+    async def acquire(self, user_id, on_queued=None, low_priority: bool = False):
+        """
+        Waits for a slot (raises SchedulerBusyError when the backlog is full), released when the block exits.
+
+        on_queued(position) is awaited once if the call has to wait in line.
+        """
+        request = self._enqueue(user_id, low_priority)
+        self._dispatch()
+        try:
+            if not request.granted:
+                if on_queued is not None:
+                    try:
+                        await on_queued(self.position(request))
+                    except Exception as e:
+                        logger.warning(f"Queue position notification failed: {e}")
+                await request.future
+        except BaseException:
+            if request.granted:
+                self._release(request)
+            else:
+                self._remove_waiting(request)
+                self._forget_if_idle(request.user_id)
+                self._dispatch()
+            raise
+        try:
+            yield
+        finally:
+            self._release(request)
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "waiting": len(self._waiting),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_s": round(self._total_wait / self._granted, 2) if self._granted else 0,
+            "users": len(set(self._user_active) | set(self._user_waiting)),
+        }
+
+
+# process-wide schedulers, created on first use
+_schedulers = {}
+
+
+def get_scheduler(name: str) -> FairScheduler:
+    if name not in _schedulers:
+        settings = dict(SCHEDULER_DEFAULTS[name])
+        prefix = name.upper()
+        for key, config_key in (
+            ("max_concurrent", f"{prefix}_MAX_CONCURRENT"),
+            ("per_user_limit", f"{prefix}_MAX_CONCURRENT_PER_USER"),
+            ("max_backlog", f"{prefix}_MAX_BACKLOG"),
+            ("max_user_backlog", f"{prefix}_MAX_USER_BACKLOG"),
+        ):
+            if config.get(config_key):
+                settings[key] = int(config[config_key])
+        _schedulers[name] = FairScheduler(name, weights=SCHEDULER_USER_WEIGHTS, **settings)
+    return _schedulers[name]
+
+
+def scheduler_stats() -> dict:
+    return {name: get_scheduler(name).stats() for name in SCHEDULER_DEFAULTS}
@@ -0,0 +1,144 @@
+"""
+Lazily created services shared by the bots and the api package.
+
+The .env config is read once per process (get_config()) instead of by every module. The backends (OpenAI chat
+client, HuggingFace text-to-image backends, S3 storage, SQS job submitter, job status store) are created on first
+use through Services, and huggingface_hub and boto3 are only imported then. The OpenAI client opens its httpx pool on
+first use as well, although python-telegram-bot already imports httpx in the bot. PIL and numpy are only imported
+once a photo is edited, so importing the handler modules stays cheap.
+
+Startup phases (e.g. persistence, handlers, warm-up) and the first construction of each backend are timed with
+startup_phase() and reported by startup_report(), which the bot logs once it is ready and shows in /metrics.
+"""
+import contextlib
+import importlib
+import logging
+import sys
+import threading
+import time
+from dotenv import dotenv_values
+from .utils import shutdown_executors
+
+logger = logging.getLogger(__name__)
+
+# when the first api module was imported, the start of the "imports" phase
+IMPORTS_STARTED = time.perf_counter()
+
+_config = None
+_config_lock = threading.Lock()
+
+# phase name -> seconds, in the order the phases first ran
+_phases = {}
+_phases_lock = threading.Lock()
+_ready_at = None
+
+
+def record_startup_phase(name: str, seconds: float) -> None:
+    with _phases_lock:
+        _phases[name] = _phases.get(name, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    """
+    Times the enclosed block as startup phase name (repeated blocks of the same phase add up).
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, time.perf_counter() - started)
+
+
+def mark_ready() -> None:
+    """
+    Records that the bot is ready to handle updates, the end of startup.
+    """
+    global _ready_at
+    if _ready_at is None:
+        _ready_at = time.perf_counter()
+
+
+def startup_report() -> dict:
+    """
+    Returns the milliseconds spent in each startup phase, and in total since the imports started once ready.
+    """
+    with _phases_lock:
+        report = {name: round(seconds * 1000, 1) for name, seconds in _phases.items()}
+    if _ready_at is not None:
+        report["total"] = round((_ready_at - IMPORTS_STARTED) * 1000, 1)
+    return report
+
+
+def get_config() -> dict:
+    """
+    Returns the .env config, read on first use and shared by every module.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                with startup_phase("config"):
+                    _config = dotenv_values(".env")
+    return _config
+
+
+class Services:
+    """
+    Accessors of the shared backends, each module imported and its backend created on first access.
+    """
+
+    @property
+    def config(self) -> dict:
+        return get_config()
+
+    @property
+    def openai(self):
+        from .openai_client import get_chat_client
+
+        return get_chat_client()
+
+    def image_backend(self, model: str = None):
+        from .inference import HF_TXT2IMG_MODEL, get_image_backend
+
+        return get_image_backend(model or HF_TXT2IMG_MODEL)
+
+    @property
+    def storage(self):
+        from .storage import get_storage
+
+        return get_storage()
+
+    @property
+    def job_submitter(self):
+        from .jobqueue import get_job_submitter
+
+        return get_job_submitter()
+
+    @property
+    def job_status(self):
+        from .job_status import get_job_status_store
+
+        return get_job_status_store()
+
+    async def aclose(self) -> None:
+        """
+        Closes the backends that were created (jobs are flushed first), then shuts down the thread pools.
+
+        The pools go last: the final SendMessageBatch calls of the job submitter still run on aws_io.
+        """
+        for module_name, close_name in (
+            ("jobqueue", "close_job_submitter"),
+            ("openai_client", "close_chat_client"),
+        ):
+            # a module that was never imported has nothing to close
+            if f"{__package__}.{module_name}" in sys.modules:
+                module = importlib.import_module(f".{module_name}", __package__)
+                await getattr(module, close_name)()
+
+        # let in-flight API calls finish before the process exits
+        shutdown_executors(wait=True)
+
+
+# process-wide container shared by the bots and the api package
+services = Services()
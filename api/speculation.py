@@ -0,0 +1,110 @@
+"""
+Bookkeeping of speculative background work per user, e.g. image designs computed for proposed themes before the
+user picks one (see api/conversation.py).
+
+Tasks are tracked here, by user id and key, rather than in user_data as user_data is persisted. Each user may spend
+SPECULATIVE_TOKEN_BUDGET (estimated) tokens of speculative completions per hour.
+"""
+import asyncio
+import logging
+import time
+from .services import get_config
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+SPECULATIVE_DESIGNS_ENABLED = (config.get("SPECULATIVE_DESIGNS_ENABLED") or "false").lower() == "true"
+# number of proposed themes (in the order shown) whose designs are computed ahead
+SPECULATIVE_DESIGN_THEMES = int(config.get("SPECULATIVE_DESIGN_THEMES") or 2)
+SPECULATIVE_TOKEN_BUDGET = int(config.get("SPECULATIVE_TOKEN_BUDGET") or 8000)
+TOKEN_BUDGET_WINDOW = 3600
+
+
+class SpeculativeTasks:
+    def __init__(self, token_budget: int = SPECULATIVE_TOKEN_BUDGET) -> None:
+        self.token_budget = token_budget
+        # user id -> {key: task}
+        self._tasks = {}
+        # user id -> [(timestamp, tokens)]
+        self._spent = {}
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.skipped_budget = 0
+
+    def tokens_left(self, user_id) -> int:
+        cutoff = time.monotonic() - TOKEN_BUDGET_WINDOW
+        spent = [entry for entry in self._spent.get(user_id, []) if entry[0] > cutoff]
+        if spent:
+            self._spent[user_id] = spent
+        else:
+            self._spent.pop(user_id, None)
+        return self.token_budget - sum(tokens for _, tokens in spent)
+
+    def start(self, user_id, key, coroutine, estimated_tokens: int) -> bool:
+        """
+        Runs coroutine in the background as user_id's speculative work for key, if the user's token budget allows.
+        """
+        if key in self._tasks.get(user_id, {}):
+            coroutine.close()
+            return False
+        if estimated_tokens > self.tokens_left(user_id):
+            coroutine.close()
+            self.skipped_budget += 1
+            return False
+        self._spent.setdefault(user_id, []).append((time.monotonic(), estimated_tokens))
+        task = asyncio.create_task(coroutine)
+        self._tasks.setdefault(user_id, {})[key] = task
+        task.add_done_callback(lambda finished: self._log_failure(user_id, key, finished))
+        self.started += 1
+        return True
+
+    def _log_failure(self, user_id, key, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"Speculative task {key!r} of user {user_id} failed: {task.exception()}")
+
+    def take(self, user_id, key):
+        """
+        Removes and returns user_id's task for key (running or finished), or None.
+        """
+        task = self._tasks.get(user_id, {}).pop(key, None)
+        if task is not None:
+            self.used += 1
+        if not self._tasks.get(user_id, True):
+            del self._tasks[user_id]
+        return task
+
+    def cancel(self, user_id) -> None:
+        """
+        Cancels all of user_id's outstanding speculative work, e.g. when the user moves on.
+        """
+        for task in self._tasks.pop(user_id, {}).values():
+            if not task.done():
+                task.cancel()
+                self.cancelled += 1
+
+    def stats(self) -> dict:
+        return {
+            "running": sum(not task.done() for tasks in self._tasks.values() for task in tasks.values()),
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "skipped_budget": self.skipped_budget,
+        }
+
+
+# process-wide registry, created on first use
+_speculative_tasks = None
+
+
+def get_speculative_tasks() -> SpeculativeTasks:
+    global _speculative_tasks
+    if _speculative_tasks is None:
+        _speculative_tasks = SpeculativeTasks()
+    return _speculative_tasks
+
+
+def speculation_stats() -> dict:
+    return get_speculative_tasks().stats()
@@ -0,0 +1,85 @@
+"""
+Shared storage layer for the images of image-editing jobs in S3.
+
+One boto3 S3 client (and its connection pool) is shared by the inpainting and outpainting handlers and the worker.
+Uploads are the preprocessed photos and masks (see api/preprocessing.py), a few hundred KB each, so they are sent
+with a single put_object.
+Set S3_ENDPOINT_URL to target a local S3-compatible stand-in (e.g. MinIO or LocalStack) for testing.
+"""
+import logging
+from .services import get_config, startup_phase
+from .utils import run_in_threadpool_decorator
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+S3_ENDPOINT_URL = config.get("S3_ENDPOINT_URL") or None
+S3_REGION = config.get("S3_REGION") or "ap-southeast-1"
+S3_MAX_POOL_CONNECTIONS = int(config.get("S3_MAX_POOL_CONNECTIONS") or 20)
+
+
+class ObjectStorage:
+    """
+    Async wrapper around a shared S3 client for one bucket.
+    """
+
+    def __init__(
+        self,
+        bucket_name: str,
+        endpoint_url: str = S3_ENDPOINT_URL,
+        region_name: str = S3_REGION,
+        max_pool_connections: int = S3_MAX_POOL_CONNECTIONS,
+    ) -> None:
+        self.bucket_name = bucket_name
+        self.endpoint_url = endpoint_url
+        self.region_name = region_name
+        self.max_pool_connections = max_pool_connections
+        self._s3_client = None
+
+    @property
+    def s3_client(self):
+        # boto3 clients are thread-safe, so one client serves every aws_io thread
+        if self._s3_client is None:
+            # boto3 is slow to import, so it is only loaded once s3 is needed
+            with startup_phase("s3 client"):
+                import boto3
+                from botocore.config import Config
+
+                self._s3_client = boto3.client(
+                    "s3",
+                    endpoint_url=self.endpoint_url,
+                    region_name=self.region_name,
+                    config=Config(max_pool_connections=self.max_pool_connections),
+                )
+        return self._s3_client
+
+    # ---------- blocking S3 calls, run on the shared aws_io pool ----------
+    @run_in_threadpool_decorator("aws_io")
+    def put_object(self, s3_key: str, data: bytes, content_type: str = "image/jpeg") -> None:
+        self.s3_client.put_object(
+            Bucket=self.bucket_name, Key=s3_key, Body=data, ContentType=content_type
+        )
+
+    @run_in_threadpool_decorator("aws_io")
+    def get_object(self, s3_key: str) -> bytes:
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+        return response["Body"].read()
+
+    # ---------- async upload paths ----------
+    async def upload_bytes(self, s3_key: str, data: bytes, content_type: str = "image/jpeg") -> int:
+        await self.put_object(s3_key, data, content_type)
+        logger.info(f"Uploaded {len(data)} bytes to s3://{self.bucket_name}/{s3_key}")
+        return len(data)
+
+
+# process-wide storage shared by every handler
+_storage = None
+
+
+def get_storage() -> ObjectStorage:
+    global _storage
+    if _storage is None:
+        _storage = ObjectStorage(bucket_name=config["BUCKET_NAME"])
+    return _storage
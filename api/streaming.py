@@ -0,0 +1,90 @@
+"""
+Progressive rendering of streamed ChatGPT responses into a Telegram message.
+
+ProgressiveMessage sends its own reply (without a reply keyboard, Telegram does not allow editing messages sent
+with one) once the first partial result arrives, then edits it in place with the latest text, at most once every
+STREAM_EDIT_INTERVAL seconds (Telegram throttles frequent edits of the same chat), always ending on the newest text.
+"""
+import asyncio
+import logging
+import time
+from .services import get_config
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+COMPLETION_STREAMING = (config.get("COMPLETION_STREAMING") or "false").lower() == "true"
+STREAM_EDIT_INTERVAL = float(config.get("STREAM_EDIT_INTERVAL") or 1.5)
+
+
+class ProgressiveMessage:
+    def __init__(self, reply_to, interval: float = STREAM_EDIT_INTERVAL, parse_mode: str = ParseMode.HTML) -> None:
+        self.reply_to = reply_to
+        self.interval = interval
+        self.parse_mode = parse_mode
+        # the message showing the partial results, sent on the first update
+        self.message = None
+        self._text = None
+        self._shown = None
+        self._rejected = None
+        self._next_edit = 0.0
+        self._task = None
+
+    def update(self, text: str) -> None:
+        """
+        Shows text as soon as the edit rate allows, replacing any text still waiting to be shown.
+        """
+        self._text = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self) -> None:
+        # stop at the newest text once it is shown, or once Telegram rejected it (wait for the next text)
+        while self._text not in (self._shown, self._rejected):
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            text = self._text
+            try:
+                if self.message is None:
+                    self.message = await self.reply_to.reply_text(text, parse_mode=self.parse_mode)
+                else:
+                    await self.message.edit_text(text, parse_mode=self.parse_mode)
+            except RetryAfter as e:
+                retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+                self._next_edit = time.monotonic() + retry_after
+                continue
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self._shown = text
+                else:
+                    # e.g. markup the partial text broke
+                    logger.warning(f"Progressive message rejected: {e}")
+                    self._rejected = text
+                self._next_edit = time.monotonic() + self.interval
+                continue
+            except TelegramError as e:
+                logger.warning(f"Progressive message failed: {e}")
+                return
+            self._shown = text
+            self._next_edit = time.monotonic() + self.interval
+
+    async def close(self) -> None:
+        """
+        Stops pending edits and deletes the message showing partial results (the final result is sent anew).
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.message is not None:
+            try:
+                await self.message.delete()
+            except TelegramError as e:
+                logger.debug(f"Could not delete progressive message: {e}")
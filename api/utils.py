@@ -1,16 +1,173 @@
 import asyncio
 import functools
+import logging
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
+logger = logging.getLogger(__name__)
+
+# default sizing of each named thread pool, can be overridden with configure_executor()
+# max_workers: number of threads in the pool
+# max_queue_size: number of submitted jobs allowed to wait for a free thread before new jobs are rejected
+EXECUTOR_DEFAULTS = {
+    "gpt_threads": {"max_workers": 10, "max_queue_size": 100},
+    "hugging_face_threads": {"max_workers": 10, "max_queue_size": 50},
+    "aws_io": {"max_workers": 10, "max_queue_size": 200},
+    "disk_io": {"max_workers": 4, "max_queue_size": 200},
+    "image_processing": {"max_workers": 2, "max_queue_size": 100},
+}
+DEFAULT_EXECUTOR_SETTINGS = {"max_workers": 10, "max_queue_size": 100}
+
+
+class ExecutorSaturatedError(RuntimeError):
+    """Raised when a named thread pool already has max_queue_size jobs waiting for a thread."""
+
+
+class BoundedThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that rejects new jobs once too many are waiting and keeps
+    active/queued/completed counts for sizing the pool.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue_size: int = None) -> None:
+        super().__init__(max_workers=max_workers, thread_name_prefix=name)
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self._counter_lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        with self._counter_lock:
+            if self.max_queue_size is not None and self.queued >= self.max_queue_size:
+                self.rejected += 1
+                raise ExecutorSaturatedError(
+                    f"Executor '{self.name}' has {self.queued} jobs waiting (limit {self.max_queue_size})"
+                )
+            self.queued += 1
+        try:
+            return super().submit(self._run, fn, *args, **kwargs)
+        except BaseException:
+            # e.g. RuntimeError after shutdown, the job never reached the queue
+            with self._counter_lock:
+                self.queued -= 1
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        with self._counter_lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            with self._counter_lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._counter_lock:
+                self.active -= 1
+                self.completed += 1
+        return result
+
+    def metrics(self) -> dict:
+        with self._counter_lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue_size": self.max_queue_size,
+                "active": self.active,
+                "queued": self.queued,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
+
+
+# process-wide registry of thread pools keyed by the decorator's name
+_executors = {}
+_executor_settings = {}
+_registry_lock = threading.Lock()
+
+
+def configure_executor(name: str, max_workers: int = None, max_queue_size: int = None) -> None:
+    """
+    Overrides the sizing of a named thread pool. Must be called before the pool is first used.
+    """
+    with _registry_lock:
+        if name in _executors:
+            raise RuntimeError(f"Executor '{name}' is already running, configure it before first use")
+        settings = dict(EXECUTOR_DEFAULTS.get(name, DEFAULT_EXECUTOR_SETTINGS))
+        if max_workers is not None:
+            settings["max_workers"] = max_workers
+        if max_queue_size is not None:
+            settings["max_queue_size"] = max_queue_size
+        _executor_settings[name] = settings
+
+
+def configure_executors_from_config(config: dict) -> None:
+    """
+    Applies <NAME>_MAX_WORKERS and <NAME>_MAX_QUEUE_SIZE overrides from .env, e.g. GPT_THREADS_MAX_WORKERS=20
+    """
+    for name in EXECUTOR_DEFAULTS:
+        max_workers = config.get(f"{name.upper()}_MAX_WORKERS")
+        max_queue_size = config.get(f"{name.upper()}_MAX_QUEUE_SIZE")
+        if max_workers or max_queue_size:
+            configure_executor(
+                name,
+                max_workers=int(max_workers) if max_workers else None,
+                max_queue_size=int(max_queue_size) if max_queue_size else None,
+            )
+
+
+def get_executor(name: str) -> BoundedThreadPoolExecutor:
+    """
+    Returns the shared thread pool for name, creating it on first use.
+    """
+    with _registry_lock:
+        executor = _executors.get(name)
+        if executor is None:
+            settings = _executor_settings.get(
+                name, EXECUTOR_DEFAULTS.get(name, DEFAULT_EXECUTOR_SETTINGS)
+            )
+            executor = BoundedThreadPoolExecutor(name, **settings)
+            _executors[name] = executor
+        return executor
+
+
+def executor_metrics() -> dict:
+    """
+    Returns active/queued/completed counts for every thread pool started so far.
+    """
+    with _registry_lock:
+        executors = dict(_executors)
+    return {name: executor.metrics() for name, executor in executors.items()}
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    """
+    Shuts down every thread pool, letting running jobs finish when wait is True.
+    """
+    with _registry_lock:
+        executors = dict(_executors)
+        _executors.clear()
+    for name, executor in executors.items():
+        logger.info(f"Shutting down executor {name}: {executor.metrics()}")
+        executor.shutdown(wait=wait, cancel_futures=not wait)
+
 
 # define wrapper function to use for I/O blocking code (any library that uses API Calls)
 def run_in_threadpool_decorator(name):
     def decorator(func):
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            loop = asyncio.get_event_loop()
-            executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix=name)
-            return loop.run_in_executor(executor, func, *args, **kwargs)
+            loop = asyncio.get_running_loop()
+            executor = get_executor(name)
+            return loop.run_in_executor(
+                executor, functools.partial(func, *args, **kwargs)
+            )
 
         return wrapper
 
@@ -0,0 +1,181 @@
+"""
+Webhook mode for the bots, an alternative to Application.run_polling().
+
+Telegram POSTs each update to http://<host>:<port>/<url_path>. The aiohttp server checks the secret token header
+(X-Telegram-Bot-Api-Secret-Token), decodes the update and puts it on application.update_queue without waiting for
+it to be handled. When more than WEBHOOK_MAX_QUEUE updates are waiting it answers 503, so Telegram retries the
+update later instead of the process piling up work. GET /healthz reports the queue depth for load balancers.
+
+Several bot processes can serve the same webhook behind a load balancer; only one of them should be started with
+--webhook-url to register the webhook with Telegram.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+from aiohttp import web
+from .services import get_config
+from telegram import Update
+from telegram.ext import Application
+
+# get config
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_MAX_QUEUE = int(config.get("WEBHOOK_MAX_QUEUE") or 100)
+# seconds Telegram is asked to wait before retrying a rejected update
+WEBHOOK_RETRY_AFTER = 5
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def add_webhook_arguments(parser) -> None:
+    """
+    Adds the webhook options to a bot's argparse parser.
+    """
+    parser.add_argument(
+        "--webhook", action="store_true", help="Receive updates through a webhook instead of polling"
+    )
+    parser.add_argument("--host", default=config.get("WEBHOOK_HOST") or "0.0.0.0", help="Webhook server address")
+    parser.add_argument("--port", type=int, default=int(config.get("WEBHOOK_PORT") or 8443), help="Webhook server port")
+    parser.add_argument(
+        "--url-path", default=config.get("WEBHOOK_PATH") or "telegram", help="Secret path updates are posted to"
+    )
+    parser.add_argument(
+        "--secret-token",
+        default=config.get("WEBHOOK_SECRET_TOKEN"),
+        help="Token Telegram sends in the X-Telegram-Bot-Api-Secret-Token header (default: WEBHOOK_SECRET_TOKEN)",
+    )
+    parser.add_argument(
+        "--webhook-url",
+        default=config.get("WEBHOOK_URL"),
+        help="Public base URL to register with Telegram (e.g. https://bot.example.com), omit when another process registers it",
+    )
+
+
+class WebhookServer:
+    def __init__(
+        self,
+        application: Application,
+        url_path: str,
+        secret_token: str,
+        max_queue: int = WEBHOOK_MAX_QUEUE,
+    ) -> None:
+        self.application = application
+        self.url_path = "/" + url_path.strip("/")
+        self.secret_token = secret_token
+        self.max_queue = max_queue
+        self.received = 0
+        self.rejected = 0
+        self.unauthorized = 0
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.application.update_queue.qsize(),
+            "max_queue": self.max_queue,
+            "received": self.received,
+            "rejected": self.rejected,
+            "unauthorized": self.unauthorized,
+        }
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.unauthorized += 1
+            return web.Response(status=403)
+
+        if self.application.update_queue.qsize() >= self.max_queue:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": str(WEBHOOK_RETRY_AFTER)})
+
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning(f"Invalid update received: {e}")
+            return web.Response(status=400)
+        self.application.update_queue.put_nowait(update)
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        status = 503 if self.application.update_queue.qsize() >= self.max_queue else 200
+        return web.Response(status=status, text=json.dumps(self.stats()), content_type="application/json")
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.url_path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+
+async def serve_webhook(
+    application: Application,
+    host: str,
+    port: int,
+    url_path: str,
+    secret_token: str,
+    webhook_url: str = None,
+    allowed_updates: list = None,
+) -> None:
+    """
+    Runs application behind the webhook server until SIGINT/SIGTERM.
+    """
+    server = WebhookServer(application, url_path, secret_token)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # same lifecycle as run_polling(): initialize, post_init, start ... stop, shutdown, post_shutdown
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    runner = web.AppRunner(server.make_app(), access_log=None)
+    try:
+        if webhook_url:
+            await application.bot.set_webhook(
+                url=webhook_url.rstrip("/") + server.url_path,
+                secret_token=secret_token,
+                allowed_updates=allowed_updates,
+            )
+        await application.start()
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Webhook server listening on {host}:{port}{server.url_path}")
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run_application(application: Application, args, allowed_updates: list = None) -> None:
+    """
+    Starts the bot with webhook mode (args.webhook) or long polling.
+    """
+    if not args.webhook:
+        application.run_polling(allowed_updates=allowed_updates)
+        return
+
+    secret_token = args.secret_token
+    if not secret_token:
+        if not args.webhook_url:
+            raise SystemExit("Webhook mode needs --secret-token (or WEBHOOK_SECRET_TOKEN) when --webhook-url is not set")
+        # this process registers the webhook, so it can pick the token itself
+        secret_token = secrets.token_urlsafe(32)
+    asyncio.run(
+        serve_webhook(
+            application,
+            host=args.host,
+            port=args.port,
+            url_path=args.url_path,
+            secret_token=secret_token,
+            webhook_url=args.webhook_url,
+            allowed_updates=allowed_updates,
+        )
+    )
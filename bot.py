@@ -20,7 +20,10 @@ from dotenv import dotenv_values
 import requests
 import json
 import argparse
-from huggingface_hub import InferenceClient
+from api.services import services
+from api.imaging import encode_image
+from api.webhook import add_webhook_arguments, run_application
+from api.log_setup import configure_logging, log_update
 
 # from flask import Flask
 # from flask import request
@@ -51,15 +54,9 @@ from telegram.ext import (
     filters,
 )
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(processName)s - %(threadName)s - [%(thread)d] - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Enable logging (written by a background thread, levels of library loggers set with LOG_LEVELS)
+configure_logging()
 logger = logging.getLogger(__name__)
-huggingFaceLogger = logging.getLogger("InferenceClient").setLevel(logging.DEBUG)
-messageHandlerLogger = logging.getLogger("telegram.bot").setLevel(logging.DEBUG)
-applicationLogger = logging.getLogger("telegram.ext").setLevel(logging.DEBUG)
 
 
 # Define a few command handlers. These usually take the two arguments update and
@@ -75,47 +72,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message when the command /help is issued."""
-    update_as_json = json.dumps(update.to_dict())
-    logger.info(update_as_json)
-    logger.info(
-        update.effective_chat.first_name
-        + " "
-        + "sent the message of:"
-        + update.message.text
-    )
+    log_update(logger, update, "help")
     await update.message.reply_text("Help!")
 
 
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Echo the user message."""
     Model = "prompthero/openjourney-v4"
-    client = InferenceClient(model=Model,token=HF_TOKEN)
-    update_as_dict = update.to_dict()
-    update_as_json = json.dumps(update_as_dict)
-    logger.info(update_as_json)
-    logger.info(
-        update_as_dict["message"]["from"]["first_name"]
-        + " "
-        + "sent the message of:"
-        + update.message.text
-    )
+    backend = services.image_backend(Model)
+    log_update(logger, update, "echo")
 
-    image = client.text_to_image(update.message.text)
-    image_path = "generic_photo.png"
-    image.save(image_path)
+    image = await backend.atext_to_image(update.message.text)
+    image_buffer = encode_image(image)
 
     await context.bot.send_photo(
         chat_id=update.effective_chat.id,
-        photo=open(image_path, "rb"),
+        photo=image_buffer,
         write_timeout=150,
         caption=update.message.text,
     )
 
 
-def main(dev_mode) -> None:
+def main(args) -> None:
     # Start the bot.
     # Create the Application and pass it your bot's token.
-    if dev_mode:
+    if args.dev:
         TELEBOT_TOKEN = config["TELEBOT_DEV_TOKEN"]
     else:
         TELEBOT_TOKEN = config["TELEBOT_TOKEN"]
@@ -128,8 +109,8 @@ def main(dev_mode) -> None:
     # on non command i.e message - echo the message on Telegram
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
 
-    # Run the bot until the user presses Ctrl-C
-    application.run_polling()
+    # Run the bot until the user presses Ctrl-C (long polling, or webhook server with --webhook)
+    run_application(application, args)
 
 
 if __name__ == "__main__":
@@ -137,6 +118,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-DEV", "--dev", action="store_true", help="Run with local Tele API token"
     )
+    add_webhook_arguments(parser)
     args = parser.parse_args()
 
-    main(args.dev)
+    main(args)
@@ -21,6 +21,7 @@ from api.conversation import (
 )
 from api.utils import run_in_threadpool_decorator
 from api.outpainting import outpainting_handler
+from api.webhook import add_webhook_arguments, run_application
 
 from telegram import __version__ as TG_VER
 from telegram import Update
@@ -88,8 +89,8 @@ async def pong(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 # function to start the bot
-def main(dev_mode) -> None:
-    if dev_mode:
+def main(args) -> None:
+    if args.dev:
         TELEBOT_TOKEN = config["TELEBOT_DEV_TOKEN"]
     else:
         TELEBOT_TOKEN = config["TELEBOT_TOKEN"]
@@ -147,7 +148,8 @@ def main(dev_mode) -> None:
     application.add_handler(conv_handler)
     application.add_handler(ping_handler)
     application.add_handler(outpainting_handler)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # long polling, or webhook server with --webhook
+    run_application(application, args, allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -155,6 +157,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-DEV", "--dev", action="store_true", help="Run with local Tele API token"
     )
+    add_webhook_arguments(parser)
     args = parser.parse_args()
 
-    main(args.dev)
+    main(args)
@@ -7,17 +7,38 @@ Usage:
 
 Press Ctrl-C on the command line or send a signal to the process to stop the bot.
 """
-import openai
 import logging
-from dotenv import dotenv_values
 import requests
 import json
 import argparse
 import os
-from huggingface_hub import InferenceClient
+import time
 from api.conversation import *
 from api.inpainting import inpainting_handler
 from api.outpainting import outpainting_handler
+from api.inference import warm_up_image_backends
+from api.cache import completion_cache_stats, image_cache_stats
+from api.scheduler import SchedulerBusyError, scheduler_stats
+from api.speculation import speculation_stats
+from api.parsing import parse_stats
+from api.prompts import token_stats
+from api.persistence import SQLitePersistence
+from api.services import (
+    IMPORTS_STARTED,
+    get_config,
+    mark_ready,
+    record_startup_phase,
+    services,
+    startup_phase,
+    startup_report,
+)
+from api.webhook import add_webhook_arguments, run_application
+from api.log_setup import configure_logging, logging_stats
+from api.utils import (
+    ExecutorSaturatedError,
+    configure_executors_from_config,
+    executor_metrics,
+)
 
 from telegram import __version__ as TG_VER
 from telegram import (
@@ -35,7 +56,6 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ConversationHandler,
-    PicklePersistence,
 )
 
 try:
@@ -51,21 +71,14 @@ if __version_info__ < (20, 0, 0, "alpha", 1):
     )
 
 # get config
-config = dotenv_values(".env")
+config = get_config()
 
-# get API tokens
-HF_TOKEN = config["HF_API_KEY"]
-openai.api_key = config["OPENAI_API_KEY"]
+# telegram user ids allowed to see /metrics, e.g. ADMIN_USER_IDS=12345,67890 (nobody when unset)
+ADMIN_USER_IDS = [int(user_id) for user_id in (config.get("ADMIN_USER_IDS") or "").split(",") if user_id.strip()]
 
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(processName)s - %(threadName)s - [%(thread)d] - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO,
-)
+# Enable logging (written by a background thread, levels of library loggers set with LOG_LEVELS)
+configure_logging()
 logger = logging.getLogger(__name__)
-huggingFaceLogger = logging.getLogger("huggingface_hub").setLevel(logging.DEBUG)
-messageHandlerLogger = logging.getLogger("telegram.bot").setLevel(logging.DEBUG)
-applicationLogger = logging.getLogger("telegram.ext").setLevel(logging.DEBUG)
 
 # assign variable name for each integer in sequence for easy tracking of conversation
 (
@@ -103,25 +116,140 @@ async def pong(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("Pong")
 
 
+# function to report the user's recent image-editing jobs (CommandHandler type)
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """reports the state of the user's most recent inpainting/outpainting jobs
+
+    Args:
+        update (Update): _description_
+        context (ContextTypes.DEFAULT_TYPE): _description_
+    Returns:
+        State and age of each recent job to the user
+    """
+    jobs = await services.job_status.latest_jobs(update.effective_user.id)
+    if not jobs:
+        await update.message.reply_text(
+            "You have no image-editing jobs yet. Send /inpainting or /outpainting to start one."
+        )
+        return
+
+    now = time.time()
+    output_text = "Your recent image-editing jobs:\n"
+    for job in jobs:
+        output_text += f"\n{job['job_type']} ({job['trace_id'][:8]}): {job['state']}, queued {int(now - job['queued_at'])}s ago"
+        if job["state"] == "running":
+            output_text += f", started {int(now - job['started_at'])}s ago"
+        elif job["state"] in ("done", "delivered"):
+            output_text += f", took {int(job['done_at'] - job['started_at'])}s"
+    await update.message.reply_text(output_text)
+
+
+# function to report thread pool usage (CommandHandler type)
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """reports active/queued/completed jobs of each backend's thread pool for sizing, cache hit rates and response parse failures (ADMIN_USER_IDS only)
+
+    Args:
+        update (Update): _description_
+        context (ContextTypes.DEFAULT_TYPE): _description_
+    Returns:
+        Metrics of each thread pool and cache to the user
+    """
+    output_text = "Thread pools:\n"
+    for name, metrics in executor_metrics().items():
+        output_text += f"{name}: " + ", ".join(f"{k}={v}" for k, v in metrics.items()) + "\n"
+    output_text += "\nCaches:\n"
+    output_text += "completion: " + ", ".join(f"{k}={v}" for k, v in completion_cache_stats().items()) + "\n"
+    output_text += "image: " + ", ".join(f"{k}={v}" for k, v in image_cache_stats().items()) + "\n"
+    output_text += "\nSchedulers:\n"
+    for name, stats in scheduler_stats().items():
+        output_text += f"{name}: " + ", ".join(f"{k}={v}" for k, v in stats.items()) + "\n"
+    output_text += "Speculative designs: " + ", ".join(f"{k}={v}" for k, v in speculation_stats().items()) + "\n"
+    output_text += "\nPersistence: " + ", ".join(f"{k}={v}" for k, v in context.application.persistence.stats().items()) + "\n"
+    output_text += "Job queue: " + ", ".join(f"{k}={v}" for k, v in services.job_submitter.stats().items()) + "\n"
+    output_text += "\nJob latency (s):\n"
+    for stage, histogram in (await services.job_status.latency_histograms()).items():
+        buckets = ", ".join(f"{k}:{v}" for k, v in histogram["buckets"].items() if v)
+        output_text += f"{stage}: count={histogram['count']}, p50={histogram['p50']}, p95={histogram['p95']} [{buckets}]\n"
+    output_text += "\nTokens per call:\n"
+    for step, stats in token_stats().items():
+        output_text += f"{step}: " + ", ".join(f"{k}={v}" for k, v in stats.items()) + "\n"
+    output_text += "Logging: " + ", ".join(f"{k}={v}" for k, v in logging_stats().items()) + "\n"
+    output_text += "\nStartup (ms): " + ", ".join(f"{k}={v}" for k, v in startup_report().items()) + "\n"
+    output_text += "\nResponse parsing:\n"
+    for step, stats in parse_stats().items():
+        output_text += f"{step}: " + ", ".join(f"{k}={v}" for k, v in stats.items()) + "\n"
+    await update.message.reply_text(output_text)
+
+
+# function to handle errors raised by handlers, tells users to retry when the backends or thread pools are overloaded
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if isinstance(context.error, (SchedulerBusyError, ExecutorSaturatedError)):
+        if isinstance(update, Update) and update.effective_message:
+            await update.effective_message.reply_text(
+                "Sorry, I am handling too many requests right now \U0001F615 Please try again in a few minutes."
+            )
+        return
+    logger.error("Exception while handling an update:", exc_info=context.error)
+
+
+# function to prepare shared backends before the bot starts polling
+async def on_startup(application: Application) -> None:
+    # open the HuggingFace connection ahead of the first image request
+    with startup_phase("warm up"):
+        await warm_up_image_backends()
+
+    mark_ready()
+    logger.info(f"Startup phases (ms): {startup_report()}")
+
+
+# function to release shared resources when the application stops
+async def on_shutdown(application: Application) -> None:
+    # send image-editing jobs still waiting for their batch, close the shared OpenAI connections,
+    # then let in-flight API calls finish before the process exits
+    await services.aclose()
+
+
 # function to start the bot
-def main(dev_mode) -> None:
-    if dev_mode:
+def main(args) -> None:
+    # everything imported before main, including the api package
+    record_startup_phase("imports", time.perf_counter() - IMPORTS_STARTED)
+
+    if args.dev:
         TELEBOT_TOKEN = config["TELEBOT_DEV_TOKEN"]
     else:
         TELEBOT_TOKEN = config["TELEBOT_TOKEN"]
 
-    # create folders for outputs
+    # create folder for persistence and caches (generated images are kept in memory unless archived)
     if not os.path.exists("data"):
         os.mkdir("data")
-    if not os.path.exists("data/image_output"):
-        os.mkdir("data/image_output")
 
-    # configure chatbot's persistence
-    persistence = PicklePersistence(filepath="data/conversation")
+    # size the shared thread pools of each backend
+    with startup_phase("executors"):
+        configure_executors_from_config(config)
+
+    # configure chatbot's persistence (users are loaded on first access, only changed data is written)
+    with startup_phase("persistence"):
+        persistence_path = config.get("PERSISTENCE_PATH") or "data/conversation.sqlite3"
+        is_new_database = not os.path.exists(persistence_path)
+        persistence = SQLitePersistence(
+            filepath=persistence_path,
+            update_interval=float(config.get("PERSISTENCE_UPDATE_INTERVAL") or 60),
+        )
+
+        # carry over conversations saved by the previous PicklePersistence
+        if is_new_database and os.path.exists("data/conversation"):
+            persistence.import_pickle_file("data/conversation")
+
+    application_started = time.perf_counter()
 
     # create the Application pass telebot's token to application
     application = (
-        Application.builder().token(TELEBOT_TOKEN).persistence(persistence).build()
+        Application.builder()
+        .token(TELEBOT_TOKEN)
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
     )
 
     # Conversation Handler with the states IMAGE_TYPE, IMAGE_PURPOSE, SELECTED_THEME, SELECTED_IMAGE_DESIGN
@@ -139,6 +267,9 @@ def main(dev_mode) -> None:
                 MessageHandler(
                     filters.Regex("(Generate Image Again)"), generate_image, block=False
                 ),
+                MessageHandler(
+                    filters.Regex("(Generate Fresh Image)"), generate_image, block=False
+                ),
                 MessageHandler(
                     filters.Regex("(Generate New Image: Step-by-step Process)"),
                     validate_user,
@@ -272,11 +403,24 @@ def main(dev_mode) -> None:
     # handler to check bot's health status
     ping_handler = CommandHandler("ping", pong, block=False)
 
+    # handler to report backend thread pool usage, for admins only (it exposes the bot's internals)
+    metrics_handler = CommandHandler(
+        "metrics", metrics_command, filters=filters.User(user_id=ADMIN_USER_IDS), block=False
+    )
+
+    # handler to report the state of the user's image-editing jobs
+    status_handler = CommandHandler("status", status_command, block=False)
+
     # add handlers to application
     application.add_handler(conv_handler)
     application.add_handler(ping_handler)
+    application.add_handler(metrics_handler)
+    application.add_handler(status_handler)
+    application.add_error_handler(error_handler)
+    record_startup_phase("application", time.perf_counter() - application_started)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # long polling, or webhook server with --webhook
+    run_application(application, args, allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
@@ -284,5 +428,6 @@ if __name__ == "__main__":
     parser.add_argument(
         "-DEV", "--dev", action="store_true", help="Run with local Tele API token"
     )
+    add_webhook_arguments(parser)
     args = parser.parse_args()
-    main(args.dev)
+    main(args)
@@ -0,0 +1,220 @@
+"""
+Worker that processes the inpainting/outpainting jobs queued by the bot (api/inpainting.py, api/outpainting.py).
+
+Usage:
+1. Long polls the SQS queue (config["SQS_URL"]) for job messages, up to --concurrency jobs at a time.
+2. Fetches the base/mask images from S3, runs the edit backend (--backend, "stub" for a CPU-only stand-in) and
+sends the result back to the user's Telegram chat.
+3. Keeps in-flight messages invisible while they are being processed and deletes finished messages in batches.
+4. Records each job's running/done/delivered/failed timestamps in the job-status store (api/job_status.py).
+
+Run several workers to scale throughput. Press Ctrl-C on the command line or send a signal to the process to stop the worker.
+"""
+import argparse
+import asyncio
+import io
+import logging
+import signal
+from PIL import Image
+from telegram import Bot
+from api.editing import load_edit_backend, mask_from_upload
+from api.imaging import encode_image
+from api.jobqueue import SQSJobReceiver
+from api.job_status import get_job_status_store
+from api.jobs import JobMessageError, decode_job
+from api.storage import get_storage
+from api.services import get_config
+from api.log_setup import configure_logging
+from api.utils import run_in_threadpool_decorator, shutdown_executors
+
+# get config
+config = get_config()
+
+# Enable logging (written by a background thread)
+configure_logging()
+logger = logging.getLogger(__name__)
+
+WORKER_CONCURRENCY = int(config.get("WORKER_CONCURRENCY") or 4)
+# seconds a received message stays hidden from other workers, extended while the job is running
+VISIBILITY_TIMEOUT = int(config.get("WORKER_VISIBILITY_TIMEOUT") or 120)
+# attempts before a job is given up and the user is informed
+MAX_RECEIVES = int(config.get("WORKER_MAX_RECEIVES") or 3)
+# seconds before a failed job becomes visible again for a retry
+RETRY_DELAY = 30
+
+
+# run the edit backend on the CPU-bound thread pool
+@run_in_threadpool_decorator("image_processing")
+def run_edit(backend, job, base_bytes: bytes, mask_bytes: bytes = None) -> io.BytesIO:
+    base_image = Image.open(io.BytesIO(base_bytes))
+    base_image.load()
+    if job.job_type == "inpainting":
+        mask_image = mask_from_upload(base_image, Image.open(io.BytesIO(mask_bytes)))
+        result = backend.inpaint(base_image, mask_image, job.caption)
+    elif job.job_type == "outpainting":
+        result = backend.outpaint(base_image, job.direction, job.caption)
+    else:
+        raise ValueError(f"Unknown job type {job.job_type}")
+    return encode_image(result, fmt="PNG")
+
+
+class Worker:
+    def __init__(self, bot: Bot, receiver: SQSJobReceiver, backend, concurrency: int = WORKER_CONCURRENCY) -> None:
+        self.bot = bot
+        self.receiver = receiver
+        self.backend = backend
+        self.storage = get_storage()
+        self.job_status = get_job_status_store()
+        self.concurrency = concurrency
+        self.stopping = asyncio.Event()
+        self._tasks = set()
+        self.jobs_done = 0
+        self.jobs_failed = 0
+
+    async def run(self) -> None:
+        logger.info(f"Worker started (concurrency={self.concurrency}, backend={type(self.backend).__name__})")
+        while not self.stopping.is_set():
+            # wait for a free slot before taking more messages off the queue
+            while len(self._tasks) >= self.concurrency:
+                await asyncio.wait(self._tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            try:
+                messages = await self.receiver.receive(
+                    self.concurrency - len(self._tasks), VISIBILITY_TIMEOUT
+                )
+            except Exception as e:
+                logger.error(f"Failed to receive messages: {e}")
+                await asyncio.sleep(5)
+                continue
+
+            for message in messages:
+                task = asyncio.create_task(self.process_message(message))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+        # let running jobs finish
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info(f"Worker stopped (done={self.jobs_done}, failed={self.jobs_failed})")
+
+    async def keep_visible(self, receipt_handle: str) -> None:
+        # extend the visibility timeout well before it runs out
+        while True:
+            await asyncio.sleep(VISIBILITY_TIMEOUT / 2)
+            try:
+                await self.receiver.extend_visibility(receipt_handle, VISIBILITY_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"Failed to extend visibility: {e}")
+
+    async def update_status(self, method: str, trace_id: str, *args) -> None:
+        # status tracking must never fail a job
+        try:
+            await getattr(self.job_status, method)(trace_id, *args)
+        except Exception as e:
+            logger.warning(f"trace_id:{trace_id} failed to update job status ({method}): {e}")
+
+    async def process_job(self, job) -> io.BytesIO:
+        if job.mask_image_s3_key:
+            base_bytes, mask_bytes = await asyncio.gather(
+                self.storage.get_object(job.base_image_s3_key),
+                self.storage.get_object(job.mask_image_s3_key),
+            )
+        else:
+            base_bytes, mask_bytes = await self.storage.get_object(job.base_image_s3_key), None
+        return await run_edit(self.backend, job, base_bytes, mask_bytes)
+
+    async def process_message(self, message: dict) -> None:
+        receipt_handle = message["ReceiptHandle"]
+        try:
+            job = decode_job(message["Body"])
+        except JobMessageError as e:
+            # cannot ever be processed, drop it
+            logger.error(f"Dropping message {message.get('MessageId')}: {e}")
+            await self.receiver.delete(receipt_handle)
+            return
+
+        heartbeat = asyncio.create_task(self.keep_visible(receipt_handle))
+        try:
+            await self.update_status("mark_running", job.trace_id)
+            result = await self.process_job(job)
+            await self.update_status("mark_done", job.trace_id)
+            await self.bot.send_photo(
+                chat_id=job.chat_id,
+                photo=result,
+                caption=f"Your {job.job_type} image is ready! 🙂\n\nSend /start for a new conversation.",
+                write_timeout=150,
+            )
+            await self.update_status("mark_delivered", job.trace_id)
+            await self.receiver.delete(receipt_handle)
+            self.jobs_done += 1
+            logger.info(f"trace_id:{job.trace_id} {job.job_type} job done")
+        except Exception as e:
+            logger.exception(f"trace_id:{job.trace_id} {job.job_type} job failed: {e}")
+            receive_count = int(message.get("Attributes", {}).get("ApproximateReceiveCount", 1))
+            if receive_count >= MAX_RECEIVES:
+                self.jobs_failed += 1
+                await self.update_status("mark_failed", job.trace_id, str(e))
+                await self.receiver.delete(receipt_handle)
+                await self.notify_failure(job)
+            else:
+                # retry after a short delay instead of the full visibility timeout
+                try:
+                    await self.receiver.extend_visibility(receipt_handle, RETRY_DELAY)
+                except Exception:
+                    pass
+        finally:
+            heartbeat.cancel()
+
+    async def notify_failure(self, job) -> None:
+        try:
+            await self.bot.send_message(
+                chat_id=job.chat_id,
+                text=f"Sorry, your {job.job_type} job could not be processed, please try again or contact woaiai.\n\nSend /{job.job_type} to process a new image or /start for a new conversation.",
+            )
+        except Exception as e:
+            logger.error(f"trace_id:{job.trace_id} failed to notify user: {e}")
+
+
+async def main(dev_mode: bool, concurrency: int, backend_name: str) -> None:
+    if dev_mode:
+        TELEBOT_TOKEN = config["TELEBOT_DEV_TOKEN"]
+    else:
+        TELEBOT_TOKEN = config["TELEBOT_TOKEN"]
+
+    if config.get("SQS_URL") == "local":
+        # LocalJobQueue only exists inside the bot process, there is nothing to receive from here
+        raise SystemExit("The worker needs an SQS queue, SQS_URL=local is only for in-process tests")
+    receiver = SQSJobReceiver(queue_url=config["SQS_URL"])
+    backend = load_edit_backend(backend_name)
+
+    async with Bot(TELEBOT_TOKEN) as bot:
+        worker = Worker(bot, receiver, backend, concurrency)
+
+        # stop taking new jobs on Ctrl-C / SIGTERM
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stopping.set)
+
+        try:
+            await worker.run()
+        finally:
+            await receiver.aclose()
+            shutdown_executors(wait=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-DEV", "--dev", action="store_true", help="Run with local Tele API token"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=WORKER_CONCURRENCY, help="Jobs processed at the same time"
+    )
+    parser.add_argument(
+        "--backend",
+        default=config.get("EDIT_BACKEND") or "stub",
+        help='Edit backend: "stub" or "package.module:ClassName"',
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.dev, args.concurrency, args.backend))